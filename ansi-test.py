@@ -1,36 +1,19 @@
 import cv2
-import numpy as np
-from PIL import Image
+from matrix_render import ASCII_PALETTE
+from matrix_painter import TerminalPainter, effects_from_env
+from matrix_tiles import renderer_from_env
+from matrix_preprocess import Preprocessor
+from matrix_sources import source_from_env
 
-# ASCII characters representing different brightness levels
-ASCII_CHARS = "@%#*+=-:. "
+preprocess = Preprocessor(100)
 
-def resize_image(image, new_width=100):
-    width, height = image.size
-    aspect_ratio = height / width / 1.65
-    new_height = int(new_width * aspect_ratio)
-    return image.resize((new_width, new_height))
+# MATRIX_RENDER_WORKERS=auto renders wide frames on every core. The workers are
+# forked before the source opens: capture backends may start threads of their own
+renderer = renderer_from_env()
 
-def grayscale_image(image):
-    return image.convert("L")
-
-def map_pixels_to_ascii(image, ascii_chars=ASCII_CHARS):
-    pixels = np.array(image)
-    ascii_str = ""
-    for row in pixels:
-        for pixel in row:
-            ascii_str += ascii_chars[pixel // (255 // len(ascii_chars))]
-        ascii_str += "\n"
-    return ascii_str
-
-def image_to_ascii(image, new_width=100):
-    image = resize_image(image, new_width)
-    image = grayscale_image(image)
-    ascii_str = map_pixels_to_ascii(image)
-    return ascii_str
-
-# Capture video from camera
-cap = cv2.VideoCapture(0)
+# Capture video from the camera, or the source named by MATRIX_SOURCE
+cap = source_from_env()
+painter = TerminalPainter(ASCII_PALETTE, renderer=renderer, **effects_from_env()).start()
 
 try:
     while True:
@@ -39,18 +22,14 @@ try:
         if not ret:
             break
 
-        # Convert frame to grayscale and then to ASCII
-        frame_pil = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-        ascii_art = image_to_ascii(frame_pil)
-
-        # Clear console and print ASCII art
-        print("\033c", end="")  # ANSI escape code to clear terminal
-        print(ascii_art)
+        # Convert frame to grayscale and then to ASCII; only changed cells are redrawn
+        painter.submit(preprocess(frame).copy())  # The preprocessor reuses its buffers
 
         # Stop with 'q' key
         if cv2.waitKey(1) & 0xFF == ord('q'):
             break
 
 finally:
+    painter.close()
     cap.release()
     cv2.destroyAllWindows()
\ No newline at end of file
@@ -1,42 +1,28 @@
 import cv2
-import numpy as np
-from PIL import Image
-import os
-
-# ASCII characters representing different brightness levels
-ASCII_CHARS = "@%#*+=-:. "
-
-def resize_image(image, new_width=100):
-    width, height = image.size
-    aspect_ratio = height / width / 1.65
-    new_height = int(new_width * aspect_ratio)
-    return image.resize((new_width, new_height))
-
-def grayscale_image(image):
-    return image.convert("L")
-
-def map_pixels_to_ascii(image, ascii_chars=ASCII_CHARS):
-    pixels = np.array(image)
-    ascii_str = ""
-    for row in pixels:
-        ascii_row = "".join([ascii_chars[pixel // (256 // len(ascii_chars))] for pixel in row])
-        ascii_str += ascii_row + "\n"
-    return ascii_str
-
-def image_to_ascii(image, new_width=100):
-    image = resize_image(image, new_width)
-    image = grayscale_image(image)
-    ascii_str = map_pixels_to_ascii(image)
-    return ascii_str
-
-# Capture video from camera
-cap = cv2.VideoCapture(0)
+from matrix_render import ASCII_PALETTE
+from matrix_painter import TerminalPainter, effects_from_env
+from matrix_tiles import renderer_from_env
+from matrix_preprocess import Preprocessor
+from matrix_sources import source_from_env
+
+preprocess = Preprocessor(100)
+
+# MATRIX_RENDER_WORKERS=auto renders wide frames on every core. The workers are
+# forked before the source opens: capture backends may start threads of their own
+renderer = renderer_from_env()
+
+# Capture video from the camera, or the source named by MATRIX_SOURCE
+cap = source_from_env()
 
 # Verify camera capture
 if not cap.isOpened():
-    print("Error: Could not open camera.")
+    print("Error: Could not open video source.")
+    if renderer is not None:
+        renderer.close()
     exit()
 
+painter = TerminalPainter(ASCII_PALETTE, renderer=renderer, **effects_from_env()).start()
+
 try:
     while True:
         # Capture frame
@@ -45,18 +31,14 @@ try:
             print("Error: Failed to capture frame.")
             break
 
-        # Convert frame to ASCII
-        frame_pil = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-        ascii_art = image_to_ascii(frame_pil)
-
-        # Clear console and print ASCII art
-        os.system('cls' if os.name == 'nt' else 'clear')
-        print(ascii_art)
+        # Convert frame to ASCII and redraw only the cells that changed
+        painter.submit(preprocess(frame).copy())  # The preprocessor reuses its buffers
 
         # Stop with 'q' key
         if cv2.waitKey(1) & 0xFF == ord('q'):
             break
 
 finally:
+    painter.close()
     cap.release()
     cv2.destroyAllWindows()
@@ -1,17 +1,56 @@
 import json
 import os
+import runpy
+import shlex
 import subprocess
-from colorama import Fore, Style, init
-from pyfiglet import Figlet
+import sys
+import threading
+import time
 
-# Initialize colorama
-init(autoreset=True)
+# Only the standard library is imported up front so the menu appears at once.
+# Sessions run inside this process in the current terminal (Ctrl-C returns to
+# the menu); a warm-up thread imports NumPy, OpenCV and the session runtime
+# while the menu waits for input, so starting a session costs milliseconds.
+# Set MATRIX_TERMINAL (e.g. "gnome-terminal --") to open each session in its
+# own terminal window instead.
 
 ADDRESS_BOOK_FILE = "address_book.json"
 PORT = 5005
+HERE = os.path.dirname(os.path.abspath(__file__))
+TERMINAL = shlex.split(os.environ.get("MATRIX_TERMINAL", ""))  # Empty: run sessions in this process
+WARM_MODULES = ("numpy", "cv2", "matrix_runtime", "sounddevice")  # Imported before the first session
+
+
+class Fore:
+    """ANSI colours; every terminal the sessions draw on understands them,
+    so there is no need to import colorama for the menu."""
+    GREEN = "\033[32m"
+    YELLOW = "\033[33m"
+    MAGENTA = "\033[35m"
+    CYAN = "\033[36m"
+    RED = "\033[31m"
+
+
+class Style:
+    RESET_ALL = "\033[0m"
+
+
+def warm_up(modules=WARM_MODULES):
+    """Import the heavy session modules on a background thread and return it.
+    A session that starts early simply waits on the import lock."""
+    def load():
+        for name in modules:
+            try:
+                __import__(name)
+            except Exception:
+                pass  # Reported properly when a session needs it
+    thread = threading.Thread(target=load, daemon=True)
+    thread.start()
+    return thread
 
 def show_banner():
     """Display the banner using pyfiglet."""
+    from pyfiglet import Figlet  # Loads its fonts on import; only the banner needs it
     f = Figlet(font="slant")
     print(Fore.GREEN + f.renderText("Matrix Chat CLI") + Style.RESET_ALL)
 
@@ -55,22 +94,71 @@ def select_peer(address_book):
         print(Fore.RED + "Invalid selection. Try again." + Style.RESET_ALL)
         return None
 
-def launch_video(peer_ip):
-    """Launch the video feed in a new terminal."""
+def open_terminal(script, *args):
+    """Start a script in its own terminal window (MATRIX_TERMINAL)."""
+    subprocess.Popen(TERMINAL + [sys.executable, os.path.join(HERE, script), *args])
+
+def run_session(name, session):
+    """Run a session in this process and come back to the menu when it ends."""
+    started = time.perf_counter()
+    try:
+        session(started)
+    except KeyboardInterrupt:
+        pass
+    except SystemExit as error:
+        # Scripts run in-process call exit() on errors; that ends the session, not the menu
+        if error.code not in (None, 0):
+            print(Fore.RED + f"{name} stopped: {error.code}" + Style.RESET_ALL)
+    except Exception as error:
+        print(Fore.RED + f"{name} stopped: {error}" + Style.RESET_ALL)
+    print(Style.RESET_ALL)
+
+def report_startup(started):
+    print(Fore.GREEN + f"Started in {(time.perf_counter() - started) * 1000:.0f} ms "
+          "(Ctrl-C returns to the menu)" + Style.RESET_ALL)
+
+def launch_video(peer_ip, warming=None):
+    """Launch the video feed with the selected peer."""
     print(Fore.GREEN + "Launching video feed..." + Style.RESET_ALL)
-    subprocess.Popen(["gnome-terminal", "--", "python3", "matrix_video.py", peer_ip])
+    if TERMINAL:
+        open_terminal("matrix-video.py", "video", peer_ip)
+        return
+    def session(started):
+        from matrix_runtime import run, video_session
+        from matrix_tiles import renderer_from_env
+        if warming is not None:
+            warming.join()  # Render workers are forked; no other thread may be running
+        report_startup(started)
+        run(video_session(peer_ip, renderer=renderer_from_env()))
+    run_session("Video", session)
 
 def launch_chat(peer_ip):
-    """Launch the chat in a new terminal."""
+    """Launch the chat with the selected peer."""
     print(Fore.GREEN + "Launching chat..." + Style.RESET_ALL)
-    subprocess.Popen(["gnome-terminal", "--", "python3", "matrix_chat.py", peer_ip])
+    if TERMINAL:
+        open_terminal("matrix-chat.py", peer_ip)
+        return
+    def session(started):
+        from matrix_runtime import chat_session, run
+        report_startup(started)
+        run(chat_session(peer_ip, PORT))
+    run_session("Chat", session)
 
-def run_matrix():
-    """Run matrix.py in a new terminal."""
+def run_matrix(warming=None):
+    """Run matrix.py."""
     print(Fore.GREEN + "Launching Matrix..." + Style.RESET_ALL)
-    subprocess.Popen(["gnome-terminal", "--", "python3", "matrix.py"])
+    if TERMINAL:
+        open_terminal("matrix.py")
+        return
+    def session(started):
+        if warming is not None:
+            warming.join()  # matrix.py forks its render workers
+        report_startup(started)
+        runpy.run_path(os.path.join(HERE, "matrix.py"), run_name="__main__")
+    run_session("Matrix", session)
 
 def main():
+    warming = None if TERMINAL else warm_up()
     show_banner()
     address_book = load_address_book()
     selected_peer = None
@@ -95,7 +183,7 @@ def main():
             selected_peer = select_peer(address_book)
         elif choice == "4":
             if selected_peer:
-                launch_video(selected_peer)
+                launch_video(selected_peer, warming)
             else:
                 print(Fore.RED + "No peer selected. Please select a peer first." + Style.RESET_ALL)
         elif choice == "5":
@@ -104,7 +192,7 @@ def main():
             else:
                 print(Fore.RED + "No peer selected. Please select a peer first." + Style.RESET_ALL)
         elif choice == "6":
-            run_matrix()
+            run_matrix(warming)
         elif choice == "7":
             print(Fore.GREEN + "Exiting..." + Style.RESET_ALL)
             break
@@ -1,24 +1,12 @@
-import cv2
-import socket
-import threading
-import numpy as np
-from PIL import Image
-import sounddevice as sd
-import time
 import json
 import os
 import subprocess
 import sys
+from matrix_runtime import chat_session, group_session, run, video_session, watch_session
+from matrix_tiles import renderer_from_env
 
 # Constants
-PORT = 5005
 ADDRESS_BOOK_FILE = "address_book.json"
-SAMPLE_RATE = 44100  # Audio sample rate in Hz
-AUDIO_BUFFER_SIZE = 1024  # Buffer size for audio chunks
-
-# Matrix-inspired characters and ANSI green shades
-MATRIX_CHARS = ["@", "#", "$", "%", "&", "0", "1", " "]
-GREEN_ANSI_COLORS = ["\033[38;5;22m", "\033[38;5;28m", "\033[38;5;34m", "\033[38;5;40m", "\033[38;5;46m", "\033[38;5;82m", "\033[38;5;118m"]
 
 # Load or create the address book
 def load_address_book():
@@ -104,119 +92,31 @@ def main_menu():
         else:
             print("Invalid option. Try again.")
 
-# Functions for video feed, chat, and audio
-def resize_image(image, new_width=80):
-    width, height = image.size
-    aspect_ratio = height / width / 1.65
-    new_height = int(new_width * aspect_ratio)
-    return image.resize((new_width, new_height))
-
-def grayscale_image(image):
-    return image.convert("L")
-
-def map_pixels_to_green_matrix(image):
-    pixels = np.array(image)
-    ansi_str = ""
-    for row in pixels:
-        for pixel in row:
-            color_code = GREEN_ANSI_COLORS[pixel // (256 // len(GREEN_ANSI_COLORS))]
-            matrix_char = MATRIX_CHARS[pixel // (256 // len(MATRIX_CHARS))]
-            ansi_str += color_code + matrix_char
-        ansi_str += "\033[0m\n"  # Reset color at end of each line
-    return ansi_str
-
-def image_to_green_matrix(image, new_width=80):
-    image = resize_image(image, new_width)
-    image = grayscale_image(image)
-    return map_pixels_to_green_matrix(image)
-
-def send_video_feed(PEER_IP):
-    ADDRESS = (PEER_IP, PORT)
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    cap = cv2.VideoCapture(0)
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        frame_pil = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-        ansi_art = image_to_green_matrix(frame_pil)
-        sock.sendto(ansi_art.encode("utf-8"), ADDRESS)
-        time.sleep(0.03)
-
-def receive_video_feed():
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind(('', PORT))
-    while True:
-        data, _ = sock.recvfrom(65536)
-        try:
-            # Attempt to decode as UTF-8
-            print("\033[H" + data.decode("utf-8"))  # Print video feed to terminal
-        except UnicodeDecodeError:
-            # Ignore non-text packets (likely audio)
-            continue
-
-def send_audio(PEER_IP):
-    ADDRESS = (PEER_IP, PORT)
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    def callback(indata, frames, time, status):
-        if status:
-            print(status)
-        sock.sendto(indata.tobytes(), ADDRESS)
-    
-    with sd.InputStream(samplerate=SAMPLE_RATE, channels=1, callback=callback, blocksize=AUDIO_BUFFER_SIZE):
-        sd.sleep(int(1e9))  # Keep the stream open indefinitely
-
-def receive_audio():
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind(('', PORT))
-    with sd.OutputStream(samplerate=SAMPLE_RATE, channels=1, dtype='float32', blocksize=AUDIO_BUFFER_SIZE) as stream:
-        while True:
-            audio_data, _ = sock.recvfrom(AUDIO_BUFFER_SIZE * 2)
-            audio_array = np.frombuffer(audio_data, dtype=np.int16).astype(np.float32) / 32768.0
-            stream.write(audio_array)
-
-def chat_mode(PEER_IP):
-    ADDRESS = (PEER_IP, PORT)
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind(('', PORT))
-
-    def send_chat():
-        while True:
-            message = input("You: ")
-            if message.lower() == 'exit':
-                print("Exiting chat...")
-                break
-            sock.sendto(message.encode("utf-8"), ADDRESS)
-
-    def receive_chat():
-        while True:
-            data, _ = sock.recvfrom(65536)
-            try:
-                message = data.decode("utf-8")
-                print("\nPeer:", message)
-            except UnicodeDecodeError:
-                # Ignore non-text packets
-                continue
-
-    threads = [threading.Thread(target=send_chat), threading.Thread(target=receive_chat)]
-    for t in threads:
-        t.start()
-    for t in threads:
-        t.join()
-
 if __name__ == "__main__":
     # Check if the script is run with mode arguments
     if len(sys.argv) > 1:
         mode = sys.argv[1]
         peer_ip = sys.argv[2] if len(sys.argv) > 2 else "127.0.0.1"
+        palette = sys.argv[3] if len(sys.argv) > 3 else None  # Any matrix_render.PALETTES name; we send MATRIX_STYLE
+        # Per-stage stats: MATRIX_STATS=file.json, MATRIX_STATS_ADDR=host:port, MATRIX_OVERLAY=1
 
         if mode == "video":
-            threading.Thread(target=send_video_feed, args=(peer_ip,)).start()
-            threading.Thread(target=receive_video_feed).start()
-            threading.Thread(target=send_audio, args=(peer_ip,)).start()
-            threading.Thread(target=receive_audio).start()
+            # Video, audio and keyframe requests all share one socket and port;
+            # render workers are forked here, before any thread starts
+            run(video_session(peer_ip, palette, renderer=renderer_from_env()))
+
+        elif mode == "group":
+            # Send one encoded stream to several peers: address-book names,
+            # IPs or multicast groups (default: the whole address book)
+            address_book = load_address_book()
+            peers = [address_book.get(name, name) for name in sys.argv[2:]] or list(address_book.values())
+            run(group_session(peers))
+
+        elif mode == "watch":
+            # Receive only: from peer_ip, or from anyone on a multicast group
+            run(watch_session(peer_ip, palette, renderer=renderer_from_env()))
 
         elif mode == "chat":
-            chat_mode(peer_ip)
+            run(chat_session(peer_ip))
     else:
         main_menu()
@@ -1,83 +1,108 @@
 import cv2
-import numpy as np
-from PIL import Image
-import os
+import threading
 import time
+from matrix_render import PALETTES, style_from_env
+from matrix_painter import TerminalPainter, effects_from_env
+from matrix_tiles import renderer_from_env
+from matrix_preprocess import ASPECT_CORRECTION, Preprocessor
+from matrix_sources import source_from_env
+from matrix_pipeline import FrameScheduler, LatestSlot
+from matrix_rain import rain_from_env
 
-# Matrix-inspired characters for different brightness levels
-MATRIX_CHARS = ["@", "#", "$", "%", "&", "0", "1", " "]
+# MATRIX_STYLE picks another palette: half (half blocks, twice the rows), matrix-truecolor, ...
+palette = PALETTES[style_from_env("matrix")]
+# MATRIX_RAIN=1 adds falling glyph trails, animated at their own rate
+rain = rain_from_env()
+if rain is not None:
+    palette = rain.palette
+preprocess = Preprocessor(150, aspect=ASPECT_CORRECTION / palette.rows_per_cell)  # Higher resolution for more detail
 
-# Green ANSI color codes with varying brightness levels
-GREEN_ANSI_COLORS = [
-    "\033[38;5;22m",  # Dark green
-    "\033[38;5;28m", 
-    "\033[38;5;34m",
-    "\033[38;5;40m",
-    "\033[38;5;46m",   # Bright green
-    "\033[38;5;82m",   # Neon green
-    "\033[38;5;118m",  # Lightest green
-]
+# MATRIX_RENDER_WORKERS=auto renders wide frames on every core. The workers are
+# forked before the source opens: capture backends may start threads of their own
+renderer = renderer_from_env()
 
-def resize_image(image, new_width=150):  # Higher resolution for more detail
-    width, height = image.size
-    aspect_ratio = height / width / 1.65
-    new_height = int(new_width * aspect_ratio)
-    return image.resize((new_width, new_height))
+# Capture video from the camera, or the source named by MATRIX_SOURCE
+cap = source_from_env()
 
-def grayscale_image(image):
-    return image.convert("L")
+# Verify camera capture
+if not cap.isOpened():
+    print("Error: Could not open video source.")
+    if renderer is not None:
+        renderer.close()
+    exit()
 
-def map_pixels_to_green_matrix(image):
-    pixels = np.array(image)
-    ansi_str = ""
-    for row in pixels:
-        for pixel in row:
-            # Map pixel intensity to green ANSI color and Matrix character
-            color_code = GREEN_ANSI_COLORS[pixel // (256 // len(GREEN_ANSI_COLORS))]
-            matrix_char = MATRIX_CHARS[pixel // (256 // len(MATRIX_CHARS))]
-            ansi_str += color_code + matrix_char
-        ansi_str += "\033[0m\n"  # Reset color at end of each line
-    return ansi_str
+painter = TerminalPainter(palette, renderer=renderer, **effects_from_env()).start()
+# Paces frames to a steady rate, narrowing the grid or lowering the rate on slow machines
+scheduler = FrameScheduler(rain.fps if rain is not None else 30, width=preprocess.width)
 
-def image_to_green_matrix(image, new_width=150):  # Higher resolution parameter
-    image = resize_image(image, new_width)
-    image = grayscale_image(image)
-    ansi_str = map_pixels_to_green_matrix(image)
-    return ansi_str
+def capture(grids):
+    # Camera thread for the rain: keeps only the newest grid
+    try:
+        while not grids.closed:
+            ret, frame = cap.read()
+            if not ret:
+                print("Error: Failed to capture frame.")
+                break
+            preprocess.width = scheduler.width
+            grids.put(preprocess(frame).copy())
+    finally:
+        grids.close()
 
-# Capture video from camera
-cap = cv2.VideoCapture(0)
+def rain_loop():
+    grids = LatestSlot()
+    camera = threading.Thread(target=capture, args=(grids,), daemon=True)
+    camera.start()
+    try:
+        grid = grids.get()  # Wait for the first camera frame
+        last = time.monotonic()
+        while grid is not None:
+            scheduler.wait()
+            scheduler.begin()
+            # Step the rain every tick, over whichever camera grid is newest
+            now = time.monotonic()
+            rain.step(now - last)
+            last = now
+            painter.submit(rain.composite(grid))
+            scheduler.done(painter.cost)
+            newer = grids.get(timeout=0)
+            if newer is not None:
+                grid = newer
+            elif grids.closed:
+                break
 
-# Verify camera capture
-if not cap.isOpened():
-    print("Error: Could not open camera.")
-    exit()
+            # Stop with 'q' key
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    finally:
+        grids.close()
+        camera.join(timeout=1)  # Let a read in progress finish before the release
 
 try:
-    previous_art = ""
-    while True:
-        # Capture frame
-        ret, frame = cap.read()
-        if not ret:
-            print("Error: Failed to capture frame.")
-            break
-
-        # Convert frame to green Matrix-style ANSI art
-        frame_pil = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-        ansi_art = image_to_green_matrix(frame_pil)
+    if rain is not None:
+        rain_loop()
+    else:
+        while True:
+            if cap.realtime:
+                scheduler.wait()  # MATRIX_SPEED=max replays unthrottled
 
-        # Only print if the art has changed
-        if ansi_art != previous_art:
-            print("\033[H" + ansi_art)  # Move cursor to top and print
-            previous_art = ansi_art
+            # Capture frame
+            ret, frame = cap.read()
+            if not ret:
+                print("Error: Failed to capture frame.")
+                break
+            scheduler.begin()
 
-        # Reduce CPU usage and flickering by adding a slight delay
-        time.sleep(0.03)  # Adjust for smoother experience
+            # Convert frame to green Matrix-style ANSI art; the painter only
+            # redraws cells that changed and drops frames the terminal can't keep up with
+            preprocess.width = scheduler.width
+            painter.submit(preprocess(frame).copy())  # The preprocessor reuses its buffers
+            scheduler.done(painter.cost)
 
-        # Stop with 'q' key
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
+            # Stop with 'q' key
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
 
 finally:
+    painter.close()
     cap.release()
     cv2.destroyAllWindows()
@@ -0,0 +1,552 @@
+"""Audio packets, sample-format negotiation and an adaptive jitter buffer.
+
+Audio packets carry a sequence number, a timestamp in samples and the
+sample format they were encoded with:
+    magic     3s  b"MXA"
+    version   B
+    format    B   one of the FORMAT_* codec ids
+    seq       I   packet sequence number, wraps at 2**32
+    timestamp I   index of the first sample, wraps at 2**32
+    samples   H   samples in the packet, at SAMPLE_RATE
+
+Besides raw float32 and int16 there are 8-bit mu-law and 4-bit IMA-ADPCM,
+each optionally downsampled to 16 kHz before coding. Mu-law and the
+resampling are vectorized with NumPy; IMA-ADPCM is a per-sample recurrence
+and runs as a table-driven loop, with each packet carrying the predictor
+state it starts from so a lost packet does not desynchronize the decoder.
+`python matrix_audio.py` reports encode/decode time per block.
+
+The sending side offers the formats it can produce (AUDIO_OFFER); the
+receiving side answers with the first one it supports (AUDIO_ANSWER). Both
+travel in-band on the audio channel, once per session.
+
+The receiver plays through a JitterBuffer whose target depth follows the
+measured interarrival jitter. Missing packets are concealed by repeating
+the last block with a fade, and the buffer sheds blocks when it runs deeper
+than the target so latency stays as low as the link allows. Decoding writes
+into float blocks the buffer recycles once they have been played, and
+`read` fills the output stream's own array, so steady playback allocates
+no sample buffers.
+"""
+import math
+import struct
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from matrix_wire import WireError, seq_newer
+
+SAMPLE_RATE = 44100  # Audio sample rate in Hz
+AUDIO_BUFFER_SIZE = 1024  # Samples per packet
+
+AUDIO_MAGIC = b"MXA"
+AUDIO_OFFER = b"MXO"
+AUDIO_ANSWER = b"MXN"
+AUDIO_VERSION = 1
+AUDIO_HEADER = struct.Struct("!3sBBIIH")
+
+FORMAT_FLOAT32 = 1
+FORMAT_INT16 = 2
+FORMAT_MULAW = 3
+FORMAT_ADPCM = 4
+FORMAT_MULAW_16K = 5
+FORMAT_ADPCM_16K = 6
+FORMAT_NAMES = {
+    FORMAT_FLOAT32: "float32", FORMAT_INT16: "int16",
+    FORMAT_MULAW: "mulaw", FORMAT_ADPCM: "adpcm",
+    FORMAT_MULAW_16K: "mulaw-16k", FORMAT_ADPCM_16K: "adpcm-16k",
+}
+CODEC_RATES = {FORMAT_MULAW_16K: 16000, FORMAT_ADPCM_16K: 16000}  # Others run at SAMPLE_RATE
+# Best quality per bit first; the 16 kHz variants trade fidelity for bandwidth
+PREFERRED_FORMATS = (FORMAT_ADPCM, FORMAT_ADPCM_16K, FORMAT_MULAW, FORMAT_MULAW_16K,
+                     FORMAT_INT16, FORMAT_FLOAT32)
+DEFAULT_FORMAT = FORMAT_INT16  # Used until the peer answers an offer
+
+MULAW = 255.0
+ADPCM_STATE = struct.Struct("!hB")  # Predictor and step index a packet starts from
+ADPCM_STEPS = [
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442, 11487,
+    12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794, 32767,
+]
+ADPCM_INDEX_STEPS = [-1, -1, -1, -1, 2, 4, 6, 8] * 2
+OFFER_INTERVAL = 1.0  # Seconds between unanswered offers
+
+MIN_DEPTH = 1  # Packets buffered before playback starts
+MAX_DEPTH = 12
+DEPTH_SLACK = 2  # Extra packets tolerated above the target before shedding
+RESYNC_GAP = 64  # Sequence jump treated as a sender restart
+JITTER_MARGIN = 3.0  # Buffer this many jitter estimates of audio
+CONCEAL_FADE = 0.5  # Gain applied per consecutive concealed block
+
+AudioPacket = namedtuple("AudioPacket", "seq timestamp samples")
+
+
+def _adpcm_tables():
+    """Precompute the signed predictor change and next step index for
+    every (step index, nibble) pair."""
+    deltas, following = [], []
+    for index, step in enumerate(ADPCM_STEPS):
+        row_delta, row_next = [], []
+        for nibble in range(16):
+            change = step >> 3
+            if nibble & 4:
+                change += step
+            if nibble & 2:
+                change += step >> 1
+            if nibble & 1:
+                change += step >> 2
+            row_delta.append(-change if nibble & 8 else change)
+            row_next.append(min(max(index + ADPCM_INDEX_STEPS[nibble], 0), len(ADPCM_STEPS) - 1))
+        deltas.append(row_delta)
+        following.append(row_next)
+    return deltas, following
+
+
+ADPCM_DELTAS, ADPCM_NEXT = _adpcm_tables()
+
+# Windowed-sinc low-pass (7 kHz at 44.1 kHz) applied before downsampling
+_taps = np.arange(31) - 15
+LOWPASS = np.sinc(2 * 7000 / SAMPLE_RATE * _taps) * np.hamming(31)
+LOWPASS = (LOWPASS / LOWPASS.sum()).astype(np.float32)
+LOWPASS_DELAY = len(LOWPASS) // 2 + 1  # Samples the 16 kHz formats lag behind the input
+
+MULAW_DECODE = np.sign(np.arange(256) - 128.0) * (
+    np.power(1 + MULAW, np.abs(np.arange(256) - 128.0) / 127) - 1) / MULAW
+MULAW_DECODE = MULAW_DECODE.astype(np.float32)
+
+
+def coded_count(count, sample_format):
+    """Return how many samples a block of `count` is coded with."""
+    rate = CODEC_RATES.get(sample_format)
+    return count if rate is None else math.ceil(count * rate / SAMPLE_RATE)
+
+
+def resample(samples, count, out=None, closed=True):
+    """Linearly resample a block to `count` samples, keeping both ends.
+
+    With `closed` off the block's last sample is taken to be the next
+    block's first, so it is left out: a stream of such blocks resamples on
+    one uniform grid, without a seam where blocks meet.
+    """
+    if len(samples) == count:
+        if out is None or out is samples:
+            return samples
+        out[:] = samples
+        return out
+    if closed:
+        positions = np.linspace(0, len(samples) - 1, count)
+    else:
+        positions = np.arange(count) * ((len(samples) - 1) / count)
+    if out is None:
+        return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+    out[:] = np.interp(positions, np.arange(len(samples)), samples)
+    return out
+
+
+def mulaw_encode(samples):
+    samples = np.clip(samples, -1.0, 1.0)
+    levels = np.sign(samples) * np.log1p(MULAW * np.abs(samples)) / np.log1p(MULAW)
+    return (np.rint(levels * 127) + 128).astype(np.uint8).tobytes()
+
+
+def mulaw_decode(payload, count, out=None):
+    return np.take(MULAW_DECODE, np.frombuffer(payload, dtype=np.uint8, count=count), out=out)
+
+
+def encoder_state():
+    """Return the per-stream state encode_samples carries between blocks:
+    the ADPCM predictor and step index, and the low-pass filter's history."""
+    return [0, 0, np.zeros(len(LOWPASS), dtype=np.float32)]
+
+
+def adpcm_encode(samples, state):
+    """IMA-ADPCM encode; `state` carries [predictor, index] between blocks."""
+    predictor, index = state[:2]
+    header = ADPCM_STATE.pack(predictor, index)
+    steps, deltas, following = ADPCM_STEPS, ADPCM_DELTAS, ADPCM_NEXT
+    nibbles = []
+    for sample in (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int32).tolist():
+        step = steps[index]
+        diff = sample - predictor
+        if diff < 0:
+            nibble = 8
+            diff = -diff
+        else:
+            nibble = 0
+        if diff >= step:
+            nibble |= 4
+            diff -= step
+        if diff >= step >> 1:
+            nibble |= 2
+            diff -= step >> 1
+        if diff >= step >> 2:
+            nibble |= 1
+        predictor += deltas[index][nibble]
+        if predictor > 32767:
+            predictor = 32767
+        elif predictor < -32768:
+            predictor = -32768
+        index = following[index][nibble]
+        nibbles.append(nibble)
+    state[:2] = [predictor, index]
+    if len(nibbles) % 2:
+        nibbles.append(0)
+    packed = np.array(nibbles, dtype=np.uint8).reshape(-1, 2)
+    return header + ((packed[:, 0] << 4) | packed[:, 1]).tobytes()
+
+
+def adpcm_decode(payload, count, out=None):
+    if len(payload) < ADPCM_STATE.size + (count + 1) // 2:
+        raise WireError("truncated audio payload")
+    predictor, index = ADPCM_STATE.unpack_from(payload)
+    if index >= len(ADPCM_STEPS):
+        raise WireError(f"invalid ADPCM step index {index}")
+    packed = np.frombuffer(payload, dtype=np.uint8, offset=ADPCM_STATE.size)
+    nibbles = np.empty(len(packed) * 2, dtype=np.uint8)
+    nibbles[0::2] = packed >> 4
+    nibbles[1::2] = packed & 0x0F
+    deltas, following = ADPCM_DELTAS, ADPCM_NEXT
+    values = []
+    for nibble in nibbles[:count].tolist():
+        predictor += deltas[index][nibble]
+        if predictor > 32767:
+            predictor = 32767
+        elif predictor < -32768:
+            predictor = -32768
+        index = following[index][nibble]
+        values.append(predictor)
+    out = np.empty(count, dtype=np.float32) if out is None else out
+    out[:] = values
+    out *= np.float32(1 / 32768.0)
+    return out
+
+
+def encode_samples(samples, sample_format, state=None):
+    """Encode float samples in [-1, 1] in a wire sample format.
+
+    `state` is the per-stream list from encoder_state(). The downsampled
+    formats filter each block after the previous block's last samples, so
+    the stream is filtered and resampled as one signal. Their coded blocks
+    run from the block's first sample to the next block's, one filter
+    length late; the decoder leaves out that shared last sample.
+    """
+    samples = np.asarray(samples, dtype=np.float32)
+    state = state if state is not None else encoder_state()
+    if sample_format in CODEC_RATES:
+        history = np.concatenate((state[2], samples))
+        state[2] = history[-len(LOWPASS):]
+        samples = np.convolve(history, LOWPASS, mode="valid")  # One more than the block
+        samples = resample(samples, coded_count(len(samples) - 1, sample_format))
+    if sample_format == FORMAT_FLOAT32:
+        return samples.astype("<f4").tobytes()
+    if sample_format == FORMAT_INT16:
+        return (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+    if sample_format in (FORMAT_MULAW, FORMAT_MULAW_16K):
+        return mulaw_encode(samples)
+    if sample_format in (FORMAT_ADPCM, FORMAT_ADPCM_16K):
+        return adpcm_encode(samples, state)
+    raise ValueError(f"unknown sample format {sample_format}")
+
+
+def decode_samples(payload, sample_format, count, out=None):
+    """Decode a block of `count` samples (at SAMPLE_RATE) to float32.
+
+    With `out`, a float32 array of `count` samples, the block is decoded
+    straight into it (16 kHz formats go through one temporary for the
+    resampling) and `out` is returned.
+    """
+    coded = coded_count(count, sample_format)
+    target = out if coded == count else None
+    if sample_format == FORMAT_FLOAT32 or sample_format == FORMAT_INT16:
+        dtype = np.dtype("<f4" if sample_format == FORMAT_FLOAT32 else "<i2")
+        if len(payload) < coded * dtype.itemsize:
+            raise WireError("truncated audio payload")
+        raw = np.frombuffer(payload, dtype=dtype, count=coded)
+        if target is None:
+            samples = raw.astype(np.float32)
+            if sample_format == FORMAT_INT16:
+                samples *= np.float32(1 / 32768.0)
+        elif sample_format == FORMAT_INT16:
+            samples = np.multiply(raw, np.float32(1 / 32768.0), out=target)
+        else:
+            samples = target
+            samples[:] = raw
+    elif sample_format in (FORMAT_MULAW, FORMAT_MULAW_16K):
+        if len(payload) < coded:
+            raise WireError("truncated audio payload")
+        samples = mulaw_decode(payload, coded, target)
+    elif sample_format in (FORMAT_ADPCM, FORMAT_ADPCM_16K):
+        samples = adpcm_decode(payload, coded, target)
+    else:
+        raise WireError(f"unknown sample format {sample_format}")
+    return resample(samples, count, out, closed=False)
+
+
+def is_audio_packet(data):
+    return data[:len(AUDIO_MAGIC)] == AUDIO_MAGIC
+
+
+def decode_audio(data, allocate=None):
+    """Parse an audio packet into an AudioPacket of float32 samples.
+
+    `allocate(count)` supplies the array to decode into, e.g.
+    JitterBuffer.buffer; by default a new one is made.
+    """
+    if len(data) < AUDIO_HEADER.size:
+        raise WireError("datagram shorter than the audio header")
+    magic, version, sample_format, seq, timestamp, count = AUDIO_HEADER.unpack_from(data)
+    if magic != AUDIO_MAGIC:
+        raise WireError("not an audio packet")
+    if version != AUDIO_VERSION:
+        raise WireError(f"unsupported audio version {version}")
+    out = allocate(count) if allocate is not None else None
+    samples = decode_samples(memoryview(data)[AUDIO_HEADER.size:], sample_format, count, out)
+    return AudioPacket(seq, timestamp, samples)
+
+
+class AudioSession:
+    """Sample-format negotiation for one audio session."""
+
+    def __init__(self, formats=PREFERRED_FORMATS):
+        self.formats = tuple(formats)  # Formats we can send and decode, best first
+        self.send_format = None  # Agreed format for our outgoing audio
+        self.last_offer = None
+
+    @property
+    def format(self):
+        return self.send_format or DEFAULT_FORMAT
+
+    def offer_due(self, now=None):
+        """Return True when an offer should be (re)sent."""
+        now = time.monotonic() if now is None else now
+        return self.send_format is None and (self.last_offer is None or now - self.last_offer >= OFFER_INTERVAL)
+
+    def offer(self, now=None):
+        """Return an offer datagram listing our formats."""
+        self.last_offer = time.monotonic() if now is None else now
+        return AUDIO_OFFER + bytes((AUDIO_VERSION,) + self.formats)
+
+    def answer(self, data):
+        """Answer a peer's offer with the first format we can decode."""
+        offered = bytes(data[len(AUDIO_OFFER) + 1:])
+        chosen = next((fmt for fmt in offered if fmt in self.formats), DEFAULT_FORMAT)
+        return AUDIO_ANSWER + bytes((AUDIO_VERSION, chosen))
+
+    def accept(self, data):
+        """Adopt the format from a peer's answer."""
+        if len(data) >= len(AUDIO_ANSWER) + 2 and data[len(AUDIO_ANSWER) + 1] in self.formats:
+            self.send_format = data[len(AUDIO_ANSWER) + 1]
+
+    def handle(self, data):
+        """Process an in-band negotiation datagram; return a reply or None.
+
+        Returns False if `data` is not a negotiation message.
+        """
+        if data[:len(AUDIO_OFFER)] == AUDIO_OFFER:
+            return self.answer(data)
+        if data[:len(AUDIO_ANSWER)] == AUDIO_ANSWER:
+            self.accept(data)
+            return None
+        return False
+
+
+class AudioSender:
+    """Turn captured blocks into sequenced, timestamped packets."""
+
+    def __init__(self, session):
+        self.session = session
+        self.seq = 0
+        self.timestamp = 0
+        self.state = encoder_state()  # ADPCM predictor and filter history
+
+    def encode(self, samples):
+        samples = np.asarray(samples, dtype=np.float32).reshape(-1)
+        sample_format = self.session.format
+        header = AUDIO_HEADER.pack(AUDIO_MAGIC, AUDIO_VERSION, sample_format,
+                                   self.seq, self.timestamp, len(samples))
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        self.timestamp = (self.timestamp + len(samples)) & 0xFFFFFFFF
+        return header + encode_samples(samples, sample_format, self.state)
+
+
+class JitterBuffer:
+    """Reorder audio packets and play them out at an adaptive depth."""
+
+    def __init__(self, sample_rate=SAMPLE_RATE, block=AUDIO_BUFFER_SIZE,
+                 min_depth=MIN_DEPTH, max_depth=MAX_DEPTH):
+        self.sample_rate = sample_rate
+        self.block = block
+        self.min_depth = min_depth
+        self.max_depth = max_depth
+        self.target = min_depth
+        self.jitter = 0.0  # Seconds, RFC 3550 interarrival estimate
+        self.packets = {}  # seq -> float32 samples
+        self.next_seq = None
+        self.playing = False
+        self.last_block = None
+        self.lost_run = 0
+        self.received = 0
+        self.late = 0
+        self.concealed = 0
+        self.shed = 0
+        self._transit = None
+        self._free = []  # Played-out blocks for decoding into again
+        self._handed = None  # Block the last pop returned
+        self._current = None  # Block `read` is playing from, and how far in
+        self._offset = 0
+        self._silence = np.zeros(block, dtype=np.float32)
+        self._silence.flags.writeable = False
+        self._lock = threading.Lock()
+
+    def buffer(self, count):
+        """Return a float32 array for `count` samples, reusing a block that
+        has been played out; pass as decode_audio's `allocate`."""
+        with self._lock:
+            return self._take(count)
+
+    def _take(self, count):
+        while self._free:
+            block = self._free.pop()
+            if len(block) == count:
+                return block
+        return np.empty(count, dtype=np.float32)
+
+    def _release(self, block):
+        if block is not None and block is not self._silence and len(self._free) < self.max_depth:
+            self._free.append(block)
+
+    def push(self, packet, arrival=None):
+        """Add a received packet."""
+        arrival = time.monotonic() if arrival is None else arrival
+        transit = arrival - packet.timestamp / self.sample_rate
+        with self._lock:
+            if self._transit is not None:
+                delta = abs(transit - self._transit)
+                if delta < 1.0:  # Ignore timestamp wraps and sender restarts
+                    self.jitter += (delta - self.jitter) / 16
+            self._transit = transit
+            duration = max(len(packet.samples), 1) / self.sample_rate
+            wanted = math.ceil(JITTER_MARGIN * self.jitter / duration) + self.min_depth
+            self.target = min(max(wanted, self.min_depth), self.max_depth)
+
+            if self.next_seq is not None:
+                distance = (packet.seq - self.next_seq) & 0xFFFFFFFF
+                if distance >= RESYNC_GAP and 0x100000000 - distance >= RESYNC_GAP:
+                    # Sender restarted or we fell far behind: start over
+                    for samples in self.packets.values():
+                        self._release(samples)
+                    self.packets.clear()
+                    self.next_seq = None
+                    self.playing = False
+                elif not seq_newer(packet.seq, (self.next_seq - 1) & 0xFFFFFFFF):
+                    self.late += 1
+                    self._release(packet.samples)
+                    return
+            self.received += 1
+            self._release(self.packets.get(packet.seq))  # Duplicate
+            self.packets[packet.seq] = packet.samples
+
+    def _oldest(self):
+        if self.next_seq is None:
+            return next(iter(self.packets))
+        return min(self.packets, key=lambda seq: (seq - self.next_seq) & 0xFFFFFFFF)
+
+    def pop(self):
+        """Return the next block to play: real, concealed, or silence.
+
+        The block is only valid until the next call, which may recycle it.
+        """
+        with self._lock:
+            previous, self._handed = self._handed, None
+            if previous is not self.last_block:
+                self._release(previous)  # A concealment block nobody refers to
+            if not self.playing:
+                if len(self.packets) < self.target:
+                    return self._silence
+                self.playing = True
+                self.next_seq = self._oldest()
+
+            samples = self.packets.pop(self.next_seq, None)
+            if samples is not None:
+                self._release(self.last_block)  # Played out, and no longer needed for concealment
+                self.last_block = samples
+                self.lost_run = 0
+            else:
+                # Lost or late: repeat the previous block, fading out
+                self.lost_run += 1
+                self.concealed += 1
+                if self.last_block is None:
+                    samples = self._silence
+                else:
+                    samples = self._take(len(self.last_block))
+                    np.multiply(self.last_block, np.float32(CONCEAL_FADE ** self.lost_run), out=samples)
+                if not self.packets:
+                    self.playing = False  # Underrun: rebuffer to the target depth
+            self.next_seq = (self.next_seq + 1) & 0xFFFFFFFF
+
+            # Running deeper than needed only adds latency
+            while len(self.packets) > self.target + DEPTH_SLACK:
+                self._release(self.packets.pop(self.next_seq, None))
+                self.next_seq = (self.next_seq + 1) & 0xFFFFFFFF
+                self.shed += 1
+            self._handed = samples
+            return samples
+
+    def read(self, frames, out=None):
+        """Fill `out` (or a new array) with exactly `frames` samples, for an
+        output stream callback."""
+        out = np.empty(frames, dtype=np.float32) if out is None else out
+        filled = 0
+        while filled < frames:
+            if self._current is None or self._offset >= len(self._current):
+                self._current = self.pop()
+                self._offset = 0
+            count = min(frames - filled, len(self._current) - self._offset)
+            out[filled:filled + count] = self._current[self._offset:self._offset + count]
+            filled += count
+            self._offset += count
+        return out
+
+
+def benchmark(blocks=200, block=AUDIO_BUFFER_SIZE):
+    """Time every codec on a synthetic voice-like signal.
+
+    Returns {name: (bytes per block, encode ms, decode ms, SNR dB)}.
+    """
+    rng = np.random.default_rng(0)
+    t = np.arange(block * blocks) / SAMPLE_RATE
+    signal = (0.3 * np.sin(2 * np.pi * 220 * t) * (1 + np.sin(2 * np.pi * 3 * t))
+              + 0.1 * np.sin(2 * np.pi * 1250 * t) + 0.01 * rng.standard_normal(len(t)))
+    signal = signal.astype(np.float32).reshape(blocks, block)
+    results = {}
+    for sample_format, name in FORMAT_NAMES.items():
+        state = encoder_state()
+        started = time.perf_counter()
+        payloads = [encode_samples(chunk, sample_format, state) for chunk in signal]
+        encoded = time.perf_counter()
+        decoded = np.concatenate([decode_samples(payload, sample_format, block) for payload in payloads])
+        finished = time.perf_counter()
+        delay = LOWPASS_DELAY if sample_format in CODEC_RATES else 0
+        reference = signal.reshape(-1)[:len(decoded) - delay]
+        noise = np.mean((decoded[delay:] - reference) ** 2)
+        snr = 10 * np.log10(np.mean(signal ** 2) / noise) if noise else float("inf")
+        results[name] = (
+            len(payloads[0]),
+            (encoded - started) / blocks * 1000,
+            (finished - encoded) / blocks * 1000,
+            snr,
+        )
+    return results
+
+
+if __name__ == "__main__":
+    print(f"{'codec':>10} {'bytes/block':>11} {'kbit/s':>7} {'encode ms':>9} {'decode ms':>9} {'SNR dB':>7}")
+    for name, (size, encode_ms, decode_ms, snr) in benchmark().items():
+        kbps = (size + AUDIO_HEADER.size) * 8 * SAMPLE_RATE / AUDIO_BUFFER_SIZE / 1000
+        print(f"{name:>10} {size:>11} {kbps:>7.0f} {encode_ms:>9.3f} {decode_ms:>9.3f} {snr:>7.1f}")
@@ -0,0 +1,431 @@
+"""Headless benchmarks for the video hot paths, with JSON output.
+
+Runs on synthetic frames, so no camera or terminal is needed:
+    render      fps and bytes per frame for every palette at several widths,
+                full, coalesced and through the differential painter
+    tiles       coalesced block-palette fps on a wall-sized grid, in-process
+                and through TiledRenderer pools
+    effects     time ordered dithering and edge glyphs add per frame, against
+                EFFECTS_BUDGET_MS, and their painter bytes
+    rain        digital rain steps composited with the camera grid and
+                painted, at RAIN_WIDTH columns
+    preprocess  camera frame to character grid
+    wire        encoded keyframe and delta sizes and encode time
+    pipeline    preprocess + encode + fragment, the per-frame work of
+                matrix_runtime.send_video
+    loopback    UDP throughput and latency from a sender to a receiver
+                AsyncTransport on 127.0.0.1, through fragmentation and
+                reassembly
+    receive     CPU time and garbage collections per 1000 video and audio
+                datagrams through the event-loop transport and decoders
+    audio       codec sizes and timings
+
+    python3 matrix_bench.py [--quick] [--output results.json] [--compare old.json]
+
+--compare prints every timing or size that moved by more than
+REGRESSION_THRESHOLD against an earlier run.
+"""
+import argparse
+import asyncio
+import gc
+import io
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from matrix_audio import (FORMAT_INT16, AudioSender, AudioSession, JitterBuffer, decode_audio,
+                          is_audio_packet)
+from matrix_audio import benchmark as audio_benchmark
+from matrix_painter import TerminalPainter
+from matrix_preprocess import ASPECT_CORRECTION, Preprocessor
+from matrix_runtime import AsyncTransport
+from matrix_rain import DigitalRain, rain_palette
+from matrix_render import PALETTES
+from matrix_sources import SyntheticSource
+from matrix_tiles import TiledRenderer
+from matrix_transport import VIDEO, tag
+from matrix_wire import FrameDecoder, FrameEncoder, Reassembler, fragment, timestamp_ms
+
+WIDTHS = (80, 150, 300)
+FRAMES = 60  # Synthetic frames per run
+MIN_TIME = 0.2  # Seconds each timing runs for at least
+TILE_WIDTH = 600  # Columns of the wall-sized grid the tiles section renders
+EFFECTS_WIDTH = 150
+EFFECTS_BUDGET_MS = 2.0  # Most that dithering plus edge glyphs may add per frame
+RAIN_WIDTH = 200
+RAIN_TICKS = 300  # Rain steps per palette, at RAIN_FPS over a camera at half that rate
+LOOPBACK_FRAMES = 300
+LOOPBACK_FPS = 0  # 0 sends as fast as possible
+RECEIVE_DATAGRAMS = 20000
+RECEIVE_BURST = 32  # Datagrams sent before the receiver catches up
+REGRESSION_THRESHOLD = 0.10  # Relative change reported by --compare
+
+# Metrics where larger is better; every other number is a cost
+HIGHER_IS_BETTER = ("fps", "throughput", "delivered", "ratio", "snr")
+SETTINGS = ("width", "frames", "cells", "datagrams", "workers", "budget_ms")  # Run parameters, not results
+
+
+def timed(function, min_time=MIN_TIME):
+    """Return the median seconds per call of `function()`."""
+    samples = []
+    deadline = time.perf_counter() + min_time
+    while time.perf_counter() < deadline or len(samples) < 3:
+        started = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - started)
+    return float(np.median(samples))
+
+
+def synthetic_frames(count=FRAMES):
+    source = SyntheticSource(count=count, realtime=False)
+    return [source.read()[1] for _ in range(count)]
+
+
+def bench_render(frames, widths=WIDTHS):
+    results = {}
+    for width in widths:
+        preprocess = Preprocessor(width)
+        grids = [preprocess(frame).copy() for frame in frames]
+        for name, palette in PALETTES.items():
+            full = timed(lambda: palette.render(grids[0]))
+            coalesced = timed(lambda: palette.render(grids[0], coalesce=True))
+            painter = TerminalPainter(palette, out=io.BytesIO())
+            painted = [len(painter.encode(grid)) for grid in grids]
+            results[f"{name}/{width}"] = {
+                "cells": grids[0].size,
+                "fps": 1 / full,
+                "coalesced_fps": 1 / coalesced,
+                "bytes": len(palette.render(grids[0])),
+                "coalesced_bytes": len(palette.render(grids[0], coalesce=True)),
+                "painter_bytes": float(np.mean(painted[1:])),  # Steady state, after the first full paint
+            }
+    return results
+
+
+def bench_tiles(frames, width=TILE_WIDTH):
+    grid = Preprocessor(width)(frames[0]).copy()
+    palette = PALETTES["blocks"]
+    results = {"cells": grid.size, "workers": os.cpu_count(),
+               "single_fps": 1 / timed(lambda: palette.render(grid, coalesce=True))}
+    for workers in sorted({2, os.cpu_count() or 1} - {1}):
+        renderer = TiledRenderer(workers)
+        try:
+            results[f"tiled{workers}_fps"] = 1 / timed(lambda: renderer.render(grid, palette))
+        finally:
+            renderer.close()
+    return results
+
+
+def bench_effects(frames, width=EFFECTS_WIDTH):
+    results = {}
+    for name in ("matrix", "blocks", "half-256"):
+        palette = PALETTES[name]
+        preprocess = Preprocessor(width, aspect=ASPECT_CORRECTION / palette.rows_per_cell)
+        grids = [preprocess(frame).copy() for frame in frames]
+        plain = timed(lambda: palette.cell_codes(grids[0]))
+        entry = {"cells": grids[0].size, "budget_ms": EFFECTS_BUDGET_MS}
+        for effect, options in (("dither", (True, False)), ("edges", (False, True)), ("both", (True, True))):
+            entry[f"{effect}_ms"] = (timed(lambda: palette.cell_codes(grids[0], *options)) - plain) * 1000
+            painter = TerminalPainter(palette, out=io.BytesIO(), dither=options[0], edges=options[1])
+            painted = [len(painter.encode(grid)) for grid in grids]
+            entry[f"{effect}_painter_bytes"] = float(np.mean(painted[1:]))
+        entry["within_budget"] = entry["both_ms"] <= EFFECTS_BUDGET_MS
+        results[f"{name}/{width}"] = entry
+    return results
+
+
+def bench_rain(frames, width=RAIN_WIDTH, ticks=RAIN_TICKS):
+    grids = [grid.copy() for grid in map(Preprocessor(width), frames)]
+    results = {}
+    for name, truecolor in (("256", False), ("truecolor", True)):
+        rain = DigitalRain(rain_palette(truecolor), seed=0)
+        painter = TerminalPainter(rain.palette, out=io.BytesIO())
+        sizes = []
+        started = time.perf_counter()
+        for tick in range(ticks):
+            rain.step(1 / rain.fps)
+            sizes.append(len(painter.encode(rain.composite(grids[tick // 2 % len(grids)]))))
+        elapsed = time.perf_counter() - started
+        results[f"{name}/{width}"] = {"cells": grids[0].size, "fps": ticks / elapsed,
+                                      "painter_bytes": float(np.mean(sizes[1:]))}
+    return results
+
+
+def bench_preprocess(frames, widths=WIDTHS):
+    results = {}
+    for width in widths:
+        preprocess = Preprocessor(width)
+        frame = frames[0]
+        results[str(width)] = {"ms": timed(lambda: preprocess(frame)) * 1000}
+    return results
+
+
+def bench_wire(frames, width=80):
+    preprocess = Preprocessor(width)
+    grids = [preprocess(frame).copy() for frame in frames]
+    encoder = FrameEncoder()
+    keyframes, deltas = [], []
+    started = time.perf_counter()
+    for grid in grids:
+        _seq, data = encoder.encode(grid)
+        (deltas if encoder.since_keyframe else keyframes).append(len(data))
+    elapsed = time.perf_counter() - started
+    ansi = len(PALETTES["matrix"].render(grids[0], coalesce=True))
+    return {
+        "width": width,
+        "keyframe_bytes": float(np.mean(keyframes)),
+        "delta_bytes": float(np.mean(deltas)) if deltas else None,
+        "encode_ms": elapsed / len(grids) * 1000,
+        "ansi_ratio": ansi / float(np.mean(keyframes)),
+    }
+
+
+def bench_pipeline(frames, width=80):
+    """The per-frame work of matrix_runtime.send_video, minus the socket."""
+    preprocess = Preprocessor(width)
+    encoder = FrameEncoder()
+    for _ in range(2):  # The first pass settles buffers and the compression choice
+        started = time.perf_counter()
+        for frame in frames:
+            seq, data = encoder.encode(preprocess(frame))
+            list(fragment(data, seq))
+        elapsed = time.perf_counter() - started
+    return {"width": width, "ms": elapsed / len(frames) * 1000, "fps": len(frames) / elapsed}
+
+
+def bench_loopback(frames, width=150, count=LOOPBACK_FRAMES, fps=LOOPBACK_FPS):
+    """Send encoded frames between two AsyncTransports on 127.0.0.1."""
+    preprocess = Preprocessor(width)
+    grids = [preprocess(frame).copy() for frame in frames]
+    encoder = FrameEncoder()
+    reassembler = Reassembler()
+    decoder = FrameDecoder()
+    sent_at = {}
+    latencies = []
+
+    def receive(data):
+        whole = reassembler.add(data)
+        if whole is not None:
+            frame = decoder.decode(whole)
+            if frame is not None:
+                latencies.append(time.perf_counter() - sent_at[frame.seq])
+
+    async def collect(receiver):
+        while True:
+            receive((await receiver.recv(VIDEO))[0])
+
+    async def main():
+        sender = await AsyncTransport.create(0, "127.0.0.1")
+        receiver = await AsyncTransport.create(0, "127.0.0.1")
+        receiving = asyncio.ensure_future(collect(receiver))
+        sent_bytes = 0
+        try:
+            started = time.perf_counter()
+            for index in range(count):
+                seq, data = encoder.encode(grids[index % len(grids)], timestamp_ms())
+                sent_at[seq] = time.perf_counter()
+                for packet in fragment(data, seq):
+                    sender.send(VIDEO, packet, receiver.address)
+                    sent_bytes += len(packet)
+                # Yield every frame so the receiver keeps up and its queue never overflows
+                await asyncio.sleep(max(0.0, started + (index + 1) / fps - time.perf_counter())
+                                    if fps else 0)
+            deadline = time.perf_counter() + 0.5
+            while len(latencies) < count and time.perf_counter() < deadline:
+                await asyncio.sleep(0.005)
+            return sent_bytes, time.perf_counter() - started
+        finally:
+            receiving.cancel()
+            await asyncio.gather(receiving, return_exceptions=True)
+            sender.close()
+            receiver.close()
+
+    sent_bytes, elapsed = asyncio.run(main())
+    delivered = len(latencies) / count
+    latencies = np.array(latencies or [float("nan")]) * 1000
+    return {
+        "width": width,
+        "frames": count,
+        "delivered": delivered,
+        "throughput_mbps": sent_bytes * 8 / elapsed / 1e6,
+        "fps": count / elapsed,
+        "latency_ms": float(np.median(latencies)),
+        "latency_p95_ms": float(np.percentile(latencies, 95)),
+    }
+
+
+def bench_receive(frames, count=RECEIVE_DATAGRAMS, width=80):
+    """Receive a mix of single-datagram video frames and int16 audio blocks
+    through AsyncTransport, decoding each as the sessions do."""
+    grids = [Preprocessor(width)(frame).copy() for frame in frames]
+    encoder = FrameEncoder()
+    video = [tag(VIDEO) + packet for grid in grids
+             for packet in fragment(encoder.encode(grid, timestamp_ms())[1], encoder.seq)]
+    session = AudioSession()
+    session.send_format = FORMAT_INT16
+    sender = AudioSender(session)
+    tone = np.sin(np.arange(1024) / 10).astype(np.float32) * 0.5
+    # Audio rides the video channel too so one queue sees the whole mix
+    audio = [tag(VIDEO) + sender.encode(tone) for _ in range(64)]
+    datagrams = [video[index % len(video)] if index % 3 else audio[index % len(audio)]
+                 for index in range(count)]
+
+    async def main():
+        transport = await AsyncTransport.create(0, "127.0.0.1")
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        decoder = FrameDecoder()
+        reassembler = Reassembler()
+        jitter = JitterBuffer()
+        out = np.empty(1024, dtype=np.float32)
+        received = 0
+        try:
+            collections = sum(stat["collections"] for stat in gc.get_stats())
+            started = time.process_time()
+            for first in range(0, count, RECEIVE_BURST):
+                burst = datagrams[first:first + RECEIVE_BURST]
+                for datagram in burst:
+                    sock.sendto(datagram, transport.address)
+                for _ in burst:
+                    try:
+                        data, _address = await transport.recv(VIDEO, 0.05)
+                    except asyncio.TimeoutError:
+                        break  # Lost on the loopback; move on
+                    if is_audio_packet(data):
+                        jitter.push(decode_audio(data, jitter.buffer))
+                        jitter.read(len(out), out)
+                    else:
+                        whole = reassembler.add(data)
+                        if whole is not None:
+                            decoder.decode(whole)
+                    received += 1
+            cpu = time.process_time() - started
+            collections = sum(stat["collections"] for stat in gc.get_stats()) - collections
+        finally:
+            sock.close()
+            transport.close()
+        return {
+            "datagrams": count,
+            "delivered": received / count,
+            "cpu_ms_per_1000": cpu / max(received, 1) * 1e6,
+            "gc_per_1000": collections / max(received, 1) * 1000,
+        }
+
+    return asyncio.run(main())
+
+
+def bench_audio():
+    return {name: {"bytes": size, "encode_ms": encode_ms, "decode_ms": decode_ms, "snr_db": snr}
+            for name, (size, encode_ms, decode_ms, snr) in audio_benchmark().items()}
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def run(quick=False):
+    frames = synthetic_frames(10 if quick else FRAMES)
+    widths = WIDTHS[:1] if quick else WIDTHS
+    return {
+        "environment": dict(environment(), quick=quick),
+        "render": bench_render(frames, widths),
+        "tiles": bench_tiles(frames),
+        "effects": bench_effects(frames),
+        "rain": bench_rain(frames, ticks=100 if quick else RAIN_TICKS),
+        "preprocess": bench_preprocess(frames, widths),
+        "wire": bench_wire(frames),
+        "pipeline": bench_pipeline(frames),
+        "loopback": bench_loopback(frames, count=50 if quick else LOOPBACK_FRAMES),
+        "receive": bench_receive(frames, count=5000 if quick else RECEIVE_DATAGRAMS),
+        "audio": bench_audio(),
+    }
+
+
+def flatten(results, prefix=""):
+    """Yield (dotted name, value) for every number in a results tree."""
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from flatten(value, name + ".")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+def finite(results):
+    """Return a copy of a results tree with NumPy scalars made plain and
+    infinite or NaN numbers (a lossless SNR, latencies with nothing
+    delivered) replaced by None, so the JSON stays strict."""
+    if isinstance(results, dict):
+        return {key: finite(value) for key, value in results.items()}
+    if isinstance(results, (list, tuple)):
+        return [finite(value) for value in results]
+    if isinstance(results, (float, np.floating)):
+        return float(results) if np.isfinite(results) else None
+    if isinstance(results, np.integer):
+        return int(results)
+    return results
+
+
+def compare(old, new, threshold=REGRESSION_THRESHOLD):
+    """Return [(name, old, new, change, worse)] for metrics that moved."""
+    before = dict(flatten({k: v for k, v in old.items() if k != "environment"}))
+    changes = []
+    for name, value in flatten({k: v for k, v in new.items() if k != "environment"}):
+        if name.rsplit(".", 1)[-1] in SETTINGS:
+            continue
+        previous = before.get(name)
+        if not previous or value != value or previous != previous:  # Missing, zero, None or NaN
+            continue
+        change = value / previous - 1
+        if abs(change) > threshold:
+            worse = (change < 0) if any(word in name for word in HIGHER_IS_BETTER) else (change > 0)
+            changes.append((name, previous, value, change, worse))
+    return changes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--quick", action="store_true", help="fewer frames and widths")
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    parser.add_argument("--compare", help="earlier JSON results to compare against")
+    args = parser.parse_args(argv)
+
+    results = finite(run(args.quick))
+    text = json.dumps(results, indent=2, allow_nan=False)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if baseline.get("environment", {}).get("quick") != args.quick:
+            print("warning: comparing a --quick run with a full one", file=sys.stderr)
+        changes = compare(baseline, results)
+        for name, previous, value, change, worse in changes:
+            print(f"{'REGRESSION' if worse else 'improved':>10} {name}: {previous:.4g} -> {value:.4g} "
+                  f"({change:+.0%})", file=sys.stderr)
+        return 1 if any(worse for *_, worse in changes) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,401 @@
+"""Reliable chat messages over the CHAT channel, with an SQLite history.
+
+Each message carries an id made of the sender's random session number and
+a sequence number. The receiver acknowledges every id it gets, drops
+duplicates and hands messages on in sequence order; a message that arrives
+after the receiver stopped waiting for it is still handed on, late and out
+of order, rather than lost. The sender retransmits unacknowledged messages
+with exponential backoff and packs whatever is waiting into as few
+datagrams as possible.
+
+Datagrams:
+    DATA  magic "MXC", version, type 1, count, then per message:
+          session I, seq I, sent-time d, length H, UTF-8 text
+    ACK   magic "MXC", version, type 2, count, then session I, seq I per id
+
+Every message sent or received is appended to ChatHistory, an SQLite
+database indexed by peer and time, with full-text search where SQLite has
+FTS5.
+"""
+import os
+import random
+import sqlite3
+import struct
+import threading
+import time
+
+CHAT_MAGIC = b"MXC"
+CHAT_VERSION = 1
+CHAT_HEADER = struct.Struct("!3sBBH")  # magic, version, type, count
+MESSAGE_HEADER = struct.Struct("!IIdH")  # session, seq, sent time, text length
+MESSAGE_ID = struct.Struct("!II")  # session, seq
+DATA = 1
+ACK = 2
+
+MAX_BATCH = 1200  # Bytes per datagram, below the path MTU
+MAX_TEXT = MAX_BATCH - CHAT_HEADER.size - MESSAGE_HEADER.size
+BATCH_DELAY = 0.01  # Seconds to wait for more messages before sending a batch
+RETRY_TIMEOUT = 0.3  # First retransmission after this many seconds
+MAX_RETRY_TIMEOUT = 5.0
+MAX_ATTEMPTS = 12  # Give up on a message after this many sends
+REORDER_TIMEOUT = 3.0  # Deliver past a missing message after this long; it still counts if it comes
+SEEN_IDS = 4096  # Recent ids remembered per peer for duplicate suppression
+
+HISTORY_FILE = "chat_history.db"
+INCOMING = 0
+OUTGOING = 1
+
+
+class ChatError(ValueError):
+    """Not a well-formed chat datagram."""
+
+
+def split_text(data, limit=MAX_TEXT):
+    """Split UTF-8 bytes into chunks of at most `limit` without cutting a character."""
+    chunks = []
+    while len(data) > limit:
+        cut = limit
+        while cut and data[cut] & 0xC0 == 0x80:  # Continuation byte
+            cut -= 1
+        chunks.append(data[:cut])
+        data = data[cut:]
+    chunks.append(data)
+    return chunks
+
+
+def encode_batch(messages):
+    """Pack [(session, seq, sent, text_bytes)] into one DATA datagram."""
+    parts = [CHAT_HEADER.pack(CHAT_MAGIC, CHAT_VERSION, DATA, len(messages))]
+    for session, seq, sent, text in messages:
+        parts.append(MESSAGE_HEADER.pack(session, seq, sent, len(text)))
+        parts.append(text)
+    return b"".join(parts)
+
+
+def encode_ack(ids):
+    return CHAT_HEADER.pack(CHAT_MAGIC, CHAT_VERSION, ACK, len(ids)) + b"".join(
+        MESSAGE_ID.pack(session, seq) for session, seq in ids)
+
+
+def decode(data):
+    """Return (type, items): messages as (session, seq, sent, text) for DATA,
+    (session, seq) ids for ACK."""
+    if len(data) < CHAT_HEADER.size:
+        raise ChatError("datagram shorter than the chat header")
+    magic, version, kind, count = CHAT_HEADER.unpack_from(data)
+    if magic != CHAT_MAGIC or version != CHAT_VERSION:
+        raise ChatError("not a chat datagram")
+    offset = CHAT_HEADER.size
+    items = []
+    if kind == ACK:
+        if len(data) < offset + count * MESSAGE_ID.size:
+            raise ChatError("truncated ack")
+        for _ in range(count):
+            items.append(MESSAGE_ID.unpack_from(data, offset))
+            offset += MESSAGE_ID.size
+    elif kind == DATA:
+        for _ in range(count):
+            if len(data) < offset + MESSAGE_HEADER.size:
+                raise ChatError("truncated message header")
+            session, seq, sent, length = MESSAGE_HEADER.unpack_from(data, offset)
+            offset += MESSAGE_HEADER.size
+            if len(data) < offset + length:
+                raise ChatError("truncated message text")
+            text = bytes(data[offset:offset + length]).decode("utf-8", errors="replace")
+            offset += length
+            items.append((session, seq, sent, text))
+    else:
+        raise ChatError(f"unknown chat datagram type {kind}")
+    return kind, items
+
+
+class ChatHistory:
+    """Append-only message log in SQLite, indexed by peer and time."""
+
+    def __init__(self, path=HISTORY_FILE):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()  # Send and receive threads share the connection
+        with self.lock:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.executescript("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY,
+                    peer TEXT NOT NULL,
+                    direction INTEGER NOT NULL,
+                    session INTEGER NOT NULL,
+                    seq INTEGER NOT NULL,
+                    sent REAL NOT NULL,
+                    received REAL,
+                    text TEXT NOT NULL,
+                    delivered INTEGER NOT NULL DEFAULT 0,
+                    UNIQUE (peer, direction, session, seq)
+                );
+                CREATE INDEX IF NOT EXISTS messages_peer_time ON messages (peer, sent);
+                CREATE INDEX IF NOT EXISTS messages_time ON messages (sent);
+            """)
+            self.fts = self._create_fts()
+            self.db.commit()
+
+    def _create_fts(self):
+        """Set up a full-text index if this SQLite has FTS5."""
+        try:
+            self.db.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts
+                    USING fts5(text, content='messages', content_rowid='id');
+                CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+                    INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text);
+                END;
+            """)
+            return True
+        except sqlite3.OperationalError:
+            return False  # Fall back to LIKE scans
+
+    def add(self, peer, direction, session, seq, sent, text, received=None):
+        """Record a message; return False if it was already recorded."""
+        with self.lock:
+            cursor = self.db.execute(
+                "INSERT OR IGNORE INTO messages (peer, direction, session, seq, sent, received, text)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (peer, direction, session, seq, sent, received, text))
+            self.db.commit()
+            return cursor.rowcount == 1
+
+    def mark_delivered(self, peer, ids):
+        with self.lock:
+            self.db.executemany(
+                "UPDATE messages SET delivered = 1"
+                " WHERE peer = ? AND direction = ? AND session = ? AND seq = ?",
+                [(peer, OUTGOING, session, seq) for session, seq in ids])
+            self.db.commit()
+
+    def recent(self, peer=None, limit=20):
+        """Return the last `limit` messages, oldest first, as
+        (peer, direction, sent, text, delivered) rows."""
+        where, args = ("WHERE peer = ?", (peer,)) if peer else ("", ())
+        with self.lock:
+            rows = self.db.execute(
+                f"SELECT peer, direction, sent, text, delivered FROM messages {where}"
+                " ORDER BY sent DESC, id DESC LIMIT ?", args + (limit,)).fetchall()
+        return rows[::-1]
+
+    def search(self, query, peer=None, limit=20):
+        """Return up to `limit` matching messages, newest first."""
+        peer_clause = " AND m.peer = ?" if peer else ""
+        args = (peer,) if peer else ()
+        with self.lock:
+            if self.fts:
+                # Quote the query so punctuation is matched, not parsed
+                phrase = '"' + query.replace('"', '""') + '"'
+                sql = ("SELECT m.peer, m.direction, m.sent, m.text, m.delivered FROM messages_fts f"
+                       " JOIN messages m ON m.id = f.rowid WHERE messages_fts MATCH ?"
+                       f"{peer_clause} ORDER BY m.sent DESC, m.id DESC LIMIT ?")
+                return self.db.execute(sql, (phrase,) + args + (limit,)).fetchall()
+            sql = ("SELECT m.peer, m.direction, m.sent, m.text, m.delivered FROM messages m"
+                   f" WHERE m.text LIKE ? ESCAPE '\\'{peer_clause} ORDER BY m.sent DESC, m.id DESC LIMIT ?")
+            pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            return self.db.execute(sql, (pattern,) + args + (limit,)).fetchall()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class ReliableChat:
+    """Send and receive chat messages with acks, retransmission and ordering.
+
+    `on_message(text, address)` is called for each new incoming message in
+    sequence order, except that one skipped after REORDER_TIMEOUT comes
+    whenever it arrives; `on_failed(text)` for outgoing messages given up on.
+    Feed every CHAT datagram to `handle`. Sending is up to the owner: send
+    the datagrams from `service()` whenever `next_send()` comes due, as the
+    asyncio runtime does.
+    """
+
+    def __init__(self, transport, address, channel, history=None, on_message=None, on_failed=None):
+        self.transport = transport
+        self.address = address
+        self.channel = channel
+        self.history = history
+        self.on_message = on_message or (lambda text, address: None)
+        self.on_failed = on_failed or (lambda text: None)
+        self.session = random.getrandbits(32)
+        self.seq = 0
+        self.unacked = {}  # (session, seq) -> [sent, text bytes, attempts, next send time]
+        self.peers = {}  # (address, session) -> receive state, see _receive_state
+        self.retransmitted = 0
+        self.duplicates = 0
+
+    @property
+    def peer(self):
+        return self.address[0]
+
+    def send(self, text):
+        """Queue a message; long ones are split to fit a datagram."""
+        chunks = split_text(text.encode("utf-8"))
+        now = time.time()
+        for chunk in chunks:
+            message_id = (self.session, self.seq)
+            self.seq = (self.seq + 1) & 0xFFFFFFFF
+            self.unacked[message_id] = [now, chunk, 0, 0.0]
+            if self.history is not None:
+                self.history.add(self.peer, OUTGOING, *message_id, now,
+                                 chunk.decode("utf-8", errors="replace"))
+
+    def _due(self, now):
+        """Return the ids to send now and the time of the next retry."""
+        due, wake = [], None
+        for message_id, entry in list(self.unacked.items()):
+            if entry[3] <= now:
+                if entry[2] >= MAX_ATTEMPTS:
+                    del self.unacked[message_id]
+                    self.on_failed(entry[1].decode("utf-8", errors="replace"))
+                    continue
+                due.append(message_id)
+            elif wake is None or entry[3] < wake:
+                wake = entry[3]
+        return due, wake
+
+    def next_send(self):
+        """Return the monotonic time at which something is due to be sent
+        (now or earlier if something is waiting), or None when all is acked."""
+        now = time.monotonic()
+        due, wake = self._due(now)
+        return now if due else wake
+
+    def service(self):
+        """Return the DATA datagrams due now, batching as many messages into
+        each as fit, and schedule their retransmissions."""
+        now = time.monotonic()
+        due, _ = self._due(now)
+        batches, batch, size = [], [], CHAT_HEADER.size
+        for message_id in due:
+            entry = self.unacked[message_id]
+            length = MESSAGE_HEADER.size + len(entry[1])
+            if batch and size + length > MAX_BATCH:
+                batches.append(batch)
+                batch, size = [], CHAT_HEADER.size
+            batch.append((*message_id, entry[0], entry[1]))
+            size += length
+            if entry[2]:
+                self.retransmitted += 1
+            entry[3] = now + min(RETRY_TIMEOUT * 2 ** entry[2], MAX_RETRY_TIMEOUT)
+            entry[2] += 1
+        if batch:
+            batches.append(batch)
+        return [encode_batch(batch) for batch in batches]
+
+    def _receive_state(self, address, session):
+        key = (address[0], session)
+        state = self.peers.get(key)
+        if state is None:
+            # next seq to deliver, held out-of-order messages, recent ids, time a gap appeared,
+            # seqs skipped by the gap timeout. Every session's seq starts at 0; if we joined
+            # late, the gap timeout skips ahead.
+            state = self.peers[key] = {"address": address, "next": 0, "held": {},
+                                       "seen": {}, "gap": None, "skipped": {}}
+        return state
+
+    def handle(self, data, address):
+        """Process one CHAT datagram."""
+        try:
+            kind, items = decode(data)
+        except ChatError:
+            return
+        if kind == ACK:
+            acked = [message_id for message_id in items if self.unacked.pop(message_id, None)]
+            if acked and self.history is not None:
+                self.history.mark_delivered(self.peer, acked)
+            return
+        now = time.time()
+        accepted = []  # Held or already seen; anything else must not be acked
+        for session, seq, sent, text in items:
+            state = self._receive_state(address, session)
+            if (session, seq) in state["seen"]:
+                # A duplicate whose earlier ack was lost: acknowledge it again
+                self.duplicates += 1
+                accepted.append((session, seq))
+                continue
+            late = (seq - state["next"]) & 0xFFFFFFFF >= 0x80000000
+            if late and seq not in state["skipped"]:
+                self.duplicates += 1  # Behind the delivery point and no longer remembered
+                continue
+            accepted.append((session, seq))
+            state["seen"][(session, seq)] = None
+            if len(state["seen"]) > SEEN_IDS:
+                del state["seen"][next(iter(state["seen"]))]
+            if self.history is not None:
+                self.history.add(address[0], INCOMING, session, seq, sent, text, received=now)
+            if late:
+                del state["skipped"][seq]
+                self.on_message(text, address)  # Retransmitted after we skipped past it
+            else:
+                state["held"][seq] = text
+        if accepted:
+            try:
+                self.transport.send(self.channel, encode_ack(accepted), address)
+            except OSError:
+                pass
+        self.poll(now)
+
+    def poll(self, now=None):
+        """Deliver held messages whose missing predecessors timed out; call
+        this now and then when no datagrams arrive."""
+        now = time.time() if now is None else now
+        for state in list(self.peers.values()):
+            self._deliver(state, now)
+
+    def _deliver(self, state, now):
+        held = state["held"]
+        while held:
+            if state["next"] in held:
+                self.on_message(held.pop(state["next"]), state["address"])
+                state["next"] = (state["next"] + 1) & 0xFFFFFFFF
+                state["gap"] = None
+            elif state["gap"] is None:
+                state["gap"] = now
+                return
+            elif now - state["gap"] > REORDER_TIMEOUT:
+                # Skip to the next one held, but remember the missing ones: the sender
+                # retries for far longer than this and a late arrival is still delivered
+                start = state["next"]
+                state["next"] = min(held, key=lambda seq: (seq - start) & 0xFFFFFFFF)
+                missing = (state["next"] - start) & 0xFFFFFFFF
+                skipped = state["skipped"]
+                for offset in range(max(0, missing - SEEN_IDS), missing):
+                    skipped[(start + offset) & 0xFFFFFFFF] = None
+                while len(skipped) > SEEN_IDS:
+                    del skipped[next(iter(skipped))]
+                state["gap"] = None
+            else:
+                return
+
+
+def format_history(rows, peer=None):
+    """Return printable lines for history rows."""
+    lines = []
+    for row_peer, direction, sent, text, delivered in rows:
+        stamp = time.strftime("%Y-%m-%d %H:%M", time.localtime(sent))
+        if direction == OUTGOING:
+            who = "You" + ("" if delivered else " (not delivered)")
+        else:
+            who = "Peer" if row_peer == peer else row_peer
+        lines.append(f"[{stamp}] {who}: {text}")
+    return lines
+
+
+def history_path(environ=os.environ):
+    return environ.get("MATRIX_CHAT_HISTORY", HISTORY_FILE)
+
+
+def run_command(line, history, peer):
+    """Handle /history [n] and /search <text>; return True if `line` was one."""
+    command, _, argument = line.partition(" ")
+    if command == "/history":
+        rows = history.recent(peer, int(argument) if argument.strip().isdigit() else 20)
+    elif command == "/search" and argument.strip():
+        rows = history.search(argument.strip(), peer)[::-1]
+    else:
+        return False
+    print("\n".join(format_history(rows, peer)) or "(no messages)")
+    return True
@@ -0,0 +1,185 @@
+"""Receiver reports and AIMD rate control for the video sender.
+
+The receiver keeps per-interval statistics and sends a REPORT datagram on
+the control channel every REPORT_INTERVAL seconds:
+    magic     3s  b"MXR"
+    version   B
+    loss      H   frames lost in the interval, per mille
+    jitter    H   interarrival jitter in milliseconds
+    fps       H   frames received per second, x10
+    failures  H   frames the reassembler gave up on in the interval
+
+The sender feeds reports to a RateController, which cuts quality
+multiplicatively when the receiver sees loss (width first, then bit depth,
+then frame rate) and restores it additively, in reverse order, while
+reports stay clean. Reports that stop arriving count as congestion.
+With several receivers the sender keeps one controller per receiver and
+encodes for the weakest (see `group_settings`).
+"""
+import struct
+import time
+
+from matrix_wire import seq_restarted
+
+REPORT_MAGIC = b"MXR"
+REPORT_VERSION = 1
+REPORT = struct.Struct("!3sBHHHH")
+REPORT_INTERVAL = 0.5  # Seconds between receiver reports
+REPORT_TIMEOUT = 2.0  # Silence after which the sender assumes congestion
+PEER_TIMEOUT = 10.0  # Silence after which a receiver is assumed gone
+
+LOSS_HIGH = 0.05  # Loss fraction that triggers a decrease
+LOSS_LOW = 0.01  # Loss fraction considered clean
+DECREASE = 0.75  # Multiplier applied to width and frame rate on congestion
+WIDTH_INCREASE = 8  # Columns added per clean report
+FPS_INCREASE = 2  # Frames per second added per clean report
+
+
+def is_report(data):
+    return data[:len(REPORT_MAGIC)] == REPORT_MAGIC
+
+
+class ReceiverStats:
+    """Collect loss, jitter and frame rate for receiver reports."""
+
+    def __init__(self):
+        self.jitter = 0.0  # Milliseconds
+        self.highest = None  # Highest frame sequence seen
+        self.received = 0  # Frames received this interval
+        self.interval_start = None
+        self.interval_highest = None
+        self._transit = None
+        self._failures = 0  # Reassembler drop count at the start of the interval
+
+    def on_frame(self, seq, timestamp_ms, now=None):
+        """Record a complete frame with its sender timestamp."""
+        now = time.monotonic() if now is None else now
+        transit = (int(now * 1000) - timestamp_ms) & 0xFFFFFFFF
+        if self._transit is not None:
+            delta = abs(((transit - self._transit + 0x80000000) & 0xFFFFFFFF) - 0x80000000)
+            self.jitter += (delta - self.jitter) / 16
+        self._transit = transit
+        if self.highest is not None and seq_restarted(seq, self.highest):
+            # The sender restarted: count this interval from its new sequence
+            self.highest = self.interval_highest = None
+            self.received = 0
+        if self.highest is None or 0 < (seq - self.highest) & 0xFFFFFFFF < 0x80000000:
+            self.highest = seq
+        if self.interval_highest is None:
+            self.interval_highest = (seq - 1) & 0xFFFFFFFF
+        self.received += 1
+
+    def report(self, failures=0, now=None):
+        """Return a REPORT datagram if an interval has elapsed, else None.
+
+        `failures` is the reassembler's running count of dropped frames.
+        """
+        now = time.monotonic() if now is None else now
+        if self.interval_start is None:
+            self.interval_start = now
+            self._failures = failures
+            return None
+        elapsed = now - self.interval_start
+        if elapsed < REPORT_INTERVAL:
+            return None
+        expected = 0
+        if self.highest is not None and self.interval_highest is not None:
+            expected = (self.highest - self.interval_highest) & 0xFFFFFFFF
+        loss = 1.0 - self.received / expected if expected else (1.0 if self.highest is not None else 0.0)
+        data = REPORT.pack(
+            REPORT_MAGIC, REPORT_VERSION,
+            int(min(max(loss, 0.0), 1.0) * 1000),
+            min(int(self.jitter), 0xFFFF),
+            min(int(self.received / elapsed * 10), 0xFFFF),
+            min(failures - self._failures, 0xFFFF),
+        )
+        self.interval_start = now
+        self.interval_highest = self.highest
+        self.received = 0
+        self._failures = failures
+        return data
+
+
+def parse_report(data):
+    """Return (loss, jitter_ms, fps, failures) from a REPORT datagram, or None."""
+    if len(data) < REPORT.size:
+        return None
+    magic, version, loss, jitter, fps, failures = REPORT.unpack_from(data)
+    if magic != REPORT_MAGIC or version != REPORT_VERSION:
+        return None
+    return loss / 1000, jitter, fps / 10, failures
+
+
+class RateController:
+    """AIMD control of the sender's width, bit depth and frame rate."""
+
+    def __init__(self, width, bits, fps, min_width=32, min_bits=2, min_fps=5):
+        self.max_width, self.max_bits, self.max_fps = width, bits, fps
+        self.min_width, self.min_bits, self.min_fps = min_width, min_bits, min_fps
+        self.width, self.bits, self.fps = width, bits, fps
+        self.last_report = None
+        self.last_cut = None
+
+    def on_report(self, data, now=None):
+        """Apply a receiver report; return True if the settings changed."""
+        parsed = parse_report(data)
+        if parsed is None:
+            return False
+        now = time.monotonic() if now is None else now
+        self.last_report = now
+        loss, _jitter, _fps, failures = parsed
+        if loss > LOSS_HIGH or failures:
+            return self.decrease(now)
+        if loss < LOSS_LOW:
+            return self.increase()
+        return False
+
+    def tick(self, now=None):
+        """Treat a silent receiver as congestion; return True on change."""
+        now = time.monotonic() if now is None else now
+        if self.last_report is None or now - self.last_report <= REPORT_TIMEOUT:
+            return False
+        if self.last_cut is not None and now - self.last_cut <= REPORT_TIMEOUT:
+            return False  # Keep cutting once per REPORT_TIMEOUT while silent
+        return self.decrease(now)
+
+    def stale(self, now=None):
+        """True once the receiver has been silent for PEER_TIMEOUT."""
+        now = time.monotonic() if now is None else now
+        return self.last_report is not None and now - self.last_report > PEER_TIMEOUT
+
+    def decrease(self, now):
+        # One cut per report interval, so a single loss burst is not punished twice
+        if self.last_cut is not None and now - self.last_cut < REPORT_INTERVAL:
+            return False
+        self.last_cut = now
+        if self.width > self.min_width:
+            self.width = max(self.min_width, int(self.width * DECREASE))
+        elif self.bits > self.min_bits:
+            self.bits -= 1
+        elif self.fps > self.min_fps:
+            self.fps = max(self.min_fps, self.fps * DECREASE)
+        else:
+            return False
+        return True
+
+    def increase(self):
+        if self.fps < self.max_fps:
+            self.fps = min(self.max_fps, self.fps + FPS_INCREASE)
+        elif self.bits < self.max_bits:
+            self.bits += 1
+        elif self.width < self.max_width:
+            self.width = min(self.max_width, self.width + WIDTH_INCREASE)
+        else:
+            return False
+        return True
+
+
+def group_settings(controllers, width, bits, fps):
+    """Return the (width, bits, fps) every receiver can take: the minimum
+    over all controllers, capped at the given maximums."""
+    for controller in controllers:
+        width = min(width, controller.width)
+        bits = min(bits, controller.bits)
+        fps = min(fps, controller.fps)
+    return width, bits, fps
@@ -0,0 +1,242 @@
+"""Differential terminal painter for rendered video frames.
+
+The painter remembers which glyph/color pair is on screen in every cell and
+only writes the spans that changed, each behind a cursor-positioning
+sequence. Frames fall back to a full repaint when that is smaller, and the
+threaded mode drops stale frames instead of queueing them behind a slow
+terminal. An optional status line is kept on the row below the frame.
+Full repaints can be handed to a matrix_tiles.TiledRenderer to spread very
+wide frames across cores. `dither` and `edges` turn on the palette's
+ordered dithering and edge glyphs (see matrix_render); `effects_from_env()`
+reads them from MATRIX_DITHER and MATRIX_EDGES.
+"""
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from matrix_render import MATRIX_PALETTE
+
+HOME = b"\033[H"
+CLEAR = b"\033[2J"
+RESET = b"\033[0m"
+HIDE_CURSOR = b"\033[?25l"
+SHOW_CURSOR = b"\033[?25h"
+CLEAR_TO_EOL = b"\033[K"
+SYNC_BEGIN = b"\033[?2026h"  # Synchronized output: hold redraws until SYNC_END
+SYNC_END = b"\033[?2026l"
+
+MERGE_GAP = 4  # Unchanged cells rewritten to avoid a new cursor move
+
+# Terminals known to honour synchronized output, matched against TERM/TERM_PROGRAM
+SYNC_TERMINALS = ("kitty", "wezterm", "iterm", "alacritty", "foot", "contour", "ghostty", "vscode")
+SYNC_VTE_VERSION = 6800  # VTE (gnome-terminal) gained support in 0.68
+
+
+def supports_synchronized_output(environ=os.environ):
+    """Guess whether the terminal understands the synchronized-output mode.
+
+    MATRIX_SYNC_OUTPUT=0/1 overrides the guess.
+    """
+    forced = environ.get("MATRIX_SYNC_OUTPUT")
+    if forced is not None:
+        return forced not in ("", "0")
+    if environ.get("WT_SESSION"):  # Windows Terminal
+        return True
+    vte = environ.get("VTE_VERSION", "")
+    if vte.isdigit() and int(vte) >= SYNC_VTE_VERSION:
+        return True
+    names = (environ.get("TERM", "") + " " + environ.get("TERM_PROGRAM", "")).lower()
+    return any(name in names for name in SYNC_TERMINALS)
+
+
+def effects_from_env(environ=os.environ):
+    """Return the painter's dither/edges settings from MATRIX_DITHER and
+    MATRIX_EDGES (1 turns each on)."""
+    return {name: environ.get(f"MATRIX_{name.upper()}", "") not in ("", "0")
+            for name in ("dither", "edges")}
+
+
+def cursor_to(row, col):
+    """Return the escape sequence moving the cursor to a 0-based cell."""
+    return b"\033[%d;%dH" % (row + 1, col + 1)
+
+
+class TerminalPainter:
+    """Paint grayscale frames with a palette, redrawing only changed cells."""
+
+    def __init__(self, palette=MATRIX_PALETTE, out=None, sync=None, stats=None, renderer=None,
+                 dither=False, edges=False):
+        self.palette = palette
+        self.dither = dither
+        self.edges = edges
+        self.out = out if out is not None else sys.stdout.buffer
+        self.sync = supports_synchronized_output() if sync is None else sync
+        self.screen = None  # Appearance ids currently displayed
+        self.frames = 0
+        self.dropped = 0
+        self.bytes_written = 0
+        self.cost = 0.0  # Smoothed seconds per painted frame
+        self.status = None  # Text shown under the frame, if any
+        self._shown_status = None
+        # Optional matrix_stats.Stats: times "render", "paint" and, for frames
+        # submitted with an arrival time, "frame" (arrival to on screen)
+        self.stats = stats
+        self.renderer = renderer  # Renders full repaints if set; closed with the painter
+
+        self._cond = threading.Condition()
+        self._pending = None
+        self._closed = False
+        self._thread = None
+        self._next_palette = None
+        self._error = None  # Raised by paint on the writer thread, re-raised to the caller
+
+    def set_palette(self, palette):
+        """Switch palettes; the next frame is repainted in full."""
+        if palette is not self.palette:
+            self._next_palette = palette
+
+    def encode(self, pixels):
+        """Return the bytes that bring the screen from its last state to `pixels`."""
+        if self._next_palette is not None:
+            self.palette, self._next_palette = self._next_palette, None
+            self.screen = None
+        pixels = np.asarray(pixels, dtype=np.uint8)
+        codes = self.palette.cell_codes(pixels, self.dither, self.edges)
+        keys = self.palette.appearance[codes]
+        if self.screen is None or self.screen.shape != keys.shape:
+            data = HIDE_CURSOR + CLEAR + HOME + self.render(codes)
+            self._shown_status = None
+        else:
+            changed = keys != self.screen
+            data = b""
+            if changed.any():
+                data = self.encode_spans(codes, changed)
+                if len(data) >= self.palette.codes_size(codes, coalesce=True) + len(HOME):
+                    data = HOME + self.render(codes)
+        self.screen = keys
+        status = self.status
+        if status is not None and status != self._shown_status:
+            data += cursor_to(keys.shape[0], 0) + RESET + status.encode() + CLEAR_TO_EOL
+            self._shown_status = status
+        if not data:
+            return b""
+        if self.sync:
+            data = SYNC_BEGIN + data + SYNC_END
+        return data
+
+    def render(self, codes):
+        """Render a whole frame of cell codes, coalesced, through the renderer
+        if there is one."""
+        if self.renderer is not None:
+            return self.renderer.render_codes(codes, self.palette)
+        return self.palette.render_codes(codes, coalesce=True)
+
+    def encode_spans(self, codes, changed):
+        """Encode the changed cells (of the palette's cell codes) as
+        cursor-addressed, color-coalesced spans."""
+        palette = self.palette
+        width = codes.shape[1]
+        cells = np.flatnonzero(changed)
+
+        # Spans never cross a row, and short unchanged gaps inside a row are
+        # folded into the surrounding span.
+        joined = (np.diff(cells) <= MERGE_GAP) & (cells[1:] // width == cells[:-1] // width)
+        starts = np.concatenate(([cells[0]], cells[1:][~joined]))
+        ends = np.concatenate((cells[:-1][~joined], [cells[-1]])) + 1
+
+        marks = np.zeros(codes.size + 1, dtype=np.int32)
+        marks[starts] += 1
+        marks[ends] -= 1
+        inside = np.cumsum(marks[:-1]) > 0
+
+        slots = palette.coalesced_slots(codes.ravel(), starts)[inside]
+
+        gathered = palette.table[slots]
+        body = gathered[palette.mask[slots]].tobytes()
+        offsets = np.concatenate(([0], np.cumsum(palette.lengths[slots])))
+        span_cells = np.concatenate(([0], np.cumsum(ends - starts)))
+        bounds = offsets[span_cells].tolist()
+
+        pieces = []
+        for span, start in enumerate(starts.tolist()):
+            pieces.append(cursor_to(*divmod(start, width)))
+            pieces.append(body[bounds[span]:bounds[span + 1]])
+        pieces.append(RESET)
+        return b"".join(pieces)
+
+    def paint(self, pixels, received=None):
+        """Write one frame now and return the number of bytes written.
+
+        `received` is the time.monotonic() at which the frame arrived.
+        """
+        started = time.monotonic()
+        data = self.encode(pixels)
+        encoded = time.monotonic()
+        if data:
+            self.out.write(data)
+            self.out.flush()
+        finished = time.monotonic()
+        self.cost += (finished - started - self.cost) / 8
+        self.frames += 1
+        self.bytes_written += len(data)
+        if self.stats is not None:
+            self.stats.stage("render").record(encoded - started, len(data))
+            self.stats.stage("paint").record(finished - encoded, len(data))
+            if received is not None:
+                self.stats.stage("frame").record(finished - received)
+        return len(data)
+
+    def start(self):
+        """Start the writer thread used by `submit`."""
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def submit(self, pixels, received=None):
+        """Queue a frame for the writer thread, replacing any unpainted one.
+
+        Raises whatever stopped the writer thread, if anything did.
+        """
+        self._raise_error()
+        with self._cond:
+            if self._pending is not None:
+                self.dropped += 1
+            self._pending = (pixels, received)
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None and not self._closed:
+                    self._cond.wait()
+                if self._pending is None:
+                    return
+                (pixels, received), self._pending = self._pending, None
+            try:
+                self.paint(pixels, received)
+            except BaseException as exc:
+                self._error = exc
+                return
+
+    def _raise_error(self):
+        # Raise a writer thread failure once, so close() after submit() raised doesn't repeat it
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def close(self):
+        """Stop the writer thread and restore the terminal, then raise
+        whatever stopped the writer thread, if anything did."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        if self.renderer is not None:
+            self.renderer.close()
+        self.out.write(RESET + SHOW_CURSOR + b"\n")
+        self.out.flush()
+        self._raise_error()
@@ -0,0 +1,166 @@
+"""Latest-frame-wins hand-off between threads, and frame pacing.
+
+LatestSlot passes items from one thread to another through a single slot.
+A consumer that falls behind only ever sees the newest item and the stale
+ones are dropped, so latency never builds up in a queue.
+
+FrameScheduler replaces fixed sleeps with deadlines on the monotonic clock.
+It measures how long each frame takes to process and steps the grid width,
+then the frame rate, down when the budget is exceeded and back up when
+there is headroom. Missed deadlines are skipped rather than caught up.
+"""
+import threading
+import time
+
+TARGET_FPS = 30
+MIN_FPS = 10
+LOAD_HIGH = 0.9  # Fraction of the frame period that counts as overloaded
+LOAD_LOW = 0.5  # Fraction with enough headroom to step quality back up
+DEGRADE_FRAMES = 15  # Consecutive overloaded frames before stepping down
+RECOVER_FRAMES = 60  # Consecutive light frames before stepping up
+WIDTH_STEP = 0.1  # Fraction of the base width changed per step
+FPS_STEP = 0.8  # Frame rate multiplier per step down
+
+
+class LatestSlot:
+    """A one-item queue where `put` replaces anything not yet taken."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self._full = False
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            if self._full:
+                self.dropped += 1
+            self._item = item
+            self._full = True
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Return the newest item, or None once the slot is closed and empty
+        (or `timeout` seconds pass)."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._full or self.closed, timeout):
+                return None
+            if not self._full:
+                return None
+            item, self._item, self._full = self._item, None, False
+            return item
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class FrameScheduler:
+    """Pace a render loop to a target frame rate and adapt to the machine.
+
+    Call `wait()` before capturing, `begin()` once the frame is in hand and
+    `done()` after it has been processed; read `width` for the grid width to
+    use next.
+    """
+
+    def __init__(self, fps=TARGET_FPS, width=None, min_width=None, min_fps=MIN_FPS):
+        self.target_fps = fps
+        self.fps = fps
+        self.min_fps = min(min_fps, fps)
+        self.base_width = width
+        self.width = width
+        self.min_width = min_width or (max(20, width // 2) if width else None)
+        self.deadline = None
+        self.cost = None  # Smoothed processing seconds per frame
+        self.dropped = 0  # Deadlines skipped because a frame overran
+        self.frames = 0
+        self._started = None
+        self._heavy = 0
+        self._light = 0
+
+    @property
+    def period(self):
+        return 1.0 / self.fps
+
+    def wait(self):
+        """Sleep until the next frame deadline, skipping any already missed."""
+        delay = self.next_delay()
+        if delay > 0:
+            time.sleep(delay)
+
+    def next_delay(self):
+        """Claim the next frame slot and return the seconds until it starts,
+        for callers that sleep themselves (e.g. with asyncio.sleep)."""
+        now = time.monotonic()
+        if self.deadline is None:
+            self.deadline = now
+        elif now > self.deadline + self.period:
+            # Overran by at least a whole frame: drop the missed slots
+            missed = int((now - self.deadline) / self.period)
+            self.dropped += missed
+            self.deadline += missed * self.period
+        delay = self.deadline - now
+        self.deadline += self.period
+        return delay
+
+    def begin(self):
+        self._started = time.monotonic()
+
+    def done(self, concurrent=0.0):
+        """Record the processing time of the current frame and adapt.
+
+        `concurrent` is the per-frame cost of work running on another thread
+        in parallel (such as a painter); the slower of the two sets the load.
+        """
+        if self._started is None:
+            return
+        elapsed = max(time.monotonic() - self._started, concurrent)
+        self._started = None
+        self.frames += 1
+        self.cost = elapsed if self.cost is None else self.cost + (elapsed - self.cost) / 8
+        load = self.cost / self.period
+        if load > LOAD_HIGH:
+            self._heavy += 1
+            self._light = 0
+            if self._heavy >= DEGRADE_FRAMES:
+                self._heavy = 0
+                self._step_down()
+        elif load < LOAD_LOW:
+            self._light += 1
+            self._heavy = 0
+            if self._light >= RECOVER_FRAMES:
+                self._light = 0
+                self._step_up()
+        else:
+            self._heavy = self._light = 0
+
+    def limit(self, fps=None, width=None):
+        """Cap the frame rate and width, e.g. to what the network can carry.
+
+        The scheduler still adapts below the caps and recovers up to them.
+        A cap under the configured minimum holds the value at the cap; the
+        minimum itself is left alone, so raising the cap again recovers.
+        """
+        if fps is not None:
+            self.target_fps = fps
+            self.fps = min(self.fps, fps)
+        if width is not None and self.width:
+            self.base_width = width
+            self.width = min(self.width, width)
+
+    def _step_down(self):
+        if self.width and self.width > self.min_width:
+            step = max(1, int(self.base_width * WIDTH_STEP))
+            self.width = max(self.min_width, self.width - step)
+        elif self.fps > self.min_fps:
+            self.fps = max(self.min_fps, self.fps * FPS_STEP)
+
+    def _step_up(self):
+        # Restore the frame rate first, then the resolution
+        if self.fps < self.target_fps:
+            self.fps = min(self.target_fps, self.fps / FPS_STEP)
+        elif self.width and self.width < self.base_width:
+            step = max(1, int(self.base_width * WIDTH_STEP))
+            self.width = min(self.base_width, self.width + step)
@@ -0,0 +1,156 @@
+"""Digital rain layered over the camera feed.
+
+Every column carries one falling trail: the row of its head, its speed in
+rows per second and its length, kept in NumPy arrays so `step(dt)` moves
+all columns at once. A grid of glyph ids, a few of which change every
+tick, gives the trails their flicker. `composite(luma)` blends the trails
+with a camera grid (screen blend, so the brighter of the two wins without
+clipping) and returns cell codes for the rain's RainPalette: lit cells
+take a glyph and a shade of green, the rest stay blank, so the face shows
+as glyphs under the rain on an empty background.
+
+The rain keeps its own clock: step it at RAIN_FPS with the time since the
+last step and composite with the newest camera grid, however old, so the
+rain stays smooth while the camera delivers fewer frames.
+
+`rain_from_env()` reads MATRIX_RAIN: unset or 0 for no rain, 1 for rain at
+RAIN_FPS, or the rain frame rate.
+"""
+import os
+
+import numpy as np
+
+from matrix_render import (GREEN_ANSI_COLORS, MATRIX_TINT, RESET_LINE, Palette, supports_truecolor,
+                           truecolor_ramp)
+
+# Half-width katakana and digits, one terminal cell each
+RAIN_GLYPHS = "ｦｱｲｳｴｵｶｷｸｹｺｻｼｽｾｿﾀﾁﾂﾃﾄﾅﾆﾇﾈﾊﾋﾌﾍﾎﾏﾐﾑﾒﾓﾔﾕﾖﾗﾘﾙﾚﾛﾜﾝ0123456789"
+HEAD_ANSI_COLOR = "\033[38;5;194m"  # Pale green, almost white
+HEAD_TRUECOLOR = "\033[38;2;210;255;210m"
+
+RAIN_FPS = 60
+RAIN_SPEED = (8.0, 30.0)  # Rows per second a trail falls, slowest to fastest
+RAIN_LENGTH = (0.2, 0.8)  # Trail length as a fraction of the grid height
+RAIN_GAP = 1.0  # Most grid heights a column stays dark before its next trail
+RAIN_CHURN = 0.5  # Fraction of glyphs replaced per second
+CAMERA_GAIN = 0.8  # Camera brightness under the rain, 1 for full
+CAMERA_FLOOR = 0.25  # Camera brightness (after gain) below which a cell is blank
+MAX_STEP = 0.25  # Longest step in seconds, so a stall doesn't teleport the rain
+
+
+class RainPalette(Palette):
+    """Any rain glyph in any shade of green, plus a blank cell.
+
+    Cell codes are glyph * len(colors) + shade; the last glyph is a space
+    and the last shade the trail head's highlight. Codes arrive ready-made
+    from DigitalRain.composite, so `cell_codes` passes them through.
+    """
+
+    def __init__(self, colors, glyphs=RAIN_GLYPHS, line_end=RESET_LINE):
+        self.chars = list(glyphs) + [" "]
+        self.colors = list(colors)
+        self.line_end = line_end
+        self.shades = shades = len(self.colors)
+        self.blank = (len(self.chars) - 1) * shades
+        codes = len(self.chars) * shades
+        self.line_end_slot = codes
+        self.appearance = np.arange(codes)
+        self.color_index = np.arange(codes) % shades
+
+        cells = [(color + char).encode("utf-8") for char in self.chars for color in self.colors]
+        cells.append(line_end.encode("utf-8"))
+        cells.extend(char.encode("utf-8") for char in self.chars for _ in self.colors)
+        self._build_table(cells)
+
+    def cell_codes(self, pixels, dither=False, edges=False):
+        return np.asarray(pixels)
+
+    def coalesced_slots(self, codes, starts=None):
+        slots = codes.astype(np.intp)
+        colors = self.color_index[codes]
+        same = np.zeros(codes.shape, dtype=bool)
+        same[..., 1:] = colors[..., 1:] == colors[..., :-1]
+        if starts is not None:
+            same[starts] = False
+        slots[same] += self.line_end_slot + 1
+        return slots
+
+
+def rain_palette(truecolor=None):
+    """Return a RainPalette in 24-bit greens if the terminal takes them
+    (default: guessed from COLORTERM), else in the 256-color greens."""
+    if truecolor is None:
+        truecolor = supports_truecolor()
+    if truecolor:
+        ramp = truecolor_ramp(tint=MATRIX_TINT)[1:]  # Skip black: a lit cell is never invisible
+        return RainPalette([f"\033[38;{color}m" for color in ramp] + [HEAD_TRUECOLOR])
+    return RainPalette(GREEN_ANSI_COLORS + [HEAD_ANSI_COLOR])
+
+
+class DigitalRain:
+    """Falling glyph trails over a grid, composited with camera frames."""
+
+    def __init__(self, palette=None, fps=RAIN_FPS, seed=None):
+        self.palette = palette or rain_palette()
+        self.fps = fps
+        self.rng = np.random.default_rng(seed)
+        self.shape = None
+
+    def reset(self, shape):
+        """Start fresh trails on a grid of `shape` (rows, columns)."""
+        height, width = shape
+        self.shape = shape
+        self.rows = np.arange(height, dtype=np.float32)[:, None]
+        # Spread the first heads over the screen and above it, so it starts full
+        self.head = self.rng.uniform(-height, height, width).astype(np.float32)
+        self.speed = np.empty(width, dtype=np.float32)
+        self.length = np.empty(width, dtype=np.float32)
+        self._respawn(np.arange(width), start=False)
+        self.glyphs = self.rng.integers(0, len(RAIN_GLYPHS), shape, dtype=np.uint16)
+
+    def _respawn(self, columns, start=True):
+        height = self.shape[0]
+        count = len(columns)
+        if start:
+            self.head[columns] = -self.rng.uniform(0, height * RAIN_GAP, count)
+        self.speed[columns] = self.rng.uniform(*RAIN_SPEED, count)
+        self.length[columns] = np.maximum(3, self.rng.uniform(*RAIN_LENGTH, count) * height)
+
+    def step(self, dt):
+        """Advance every trail by `dt` seconds and churn some glyphs."""
+        if self.shape is None:
+            return
+        dt = min(dt, MAX_STEP)
+        self.head += self.speed * dt
+        gone = np.flatnonzero(self.head - self.length > self.shape[0])
+        if len(gone):
+            self._respawn(gone)
+        changed = self.rng.binomial(self.glyphs.size, min(1.0, RAIN_CHURN * dt))
+        cells = self.rng.integers(0, self.glyphs.size, changed)
+        self.glyphs.flat[cells] = self.rng.integers(0, len(RAIN_GLYPHS), changed)
+
+    def composite(self, luma):
+        """Return the palette's cell codes for the rain over a grayscale grid."""
+        luma = np.asarray(luma)
+        if luma.shape != self.shape:
+            self.reset(luma.shape)  # First frame or a new grid width
+        palette = self.palette
+        behind = self.head - self.rows  # Rows behind each column's head
+        lit = (behind >= 0) & (behind < self.length)
+        rain = np.where(lit, 1 - behind / self.length, 0)
+        camera = luma * np.float32(CAMERA_GAIN / 255)
+        light = camera + rain - camera * rain
+        shade = (light * (palette.shades - 2) + 0.5).astype(np.uint16)  # The last shade is for heads
+        shade[lit & (behind < 1)] = palette.shades - 1
+        codes = self.glyphs * palette.shades + shade
+        codes[~(lit | (camera >= CAMERA_FLOOR))] = palette.blank
+        return codes
+
+
+def rain_from_env(environ=os.environ):
+    """Return a DigitalRain if MATRIX_RAIN asks for one, else None."""
+    setting = environ.get("MATRIX_RAIN", "")
+    if setting in ("", "0"):
+        return None
+    fps = RAIN_FPS if setting == "1" else float(setting)
+    return DigitalRain(rain_palette(supports_truecolor(environ)), fps)
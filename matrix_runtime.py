@@ -0,0 +1,684 @@
+"""asyncio runtime for video, audio and chat sessions.
+
+One event loop owns the UDP socket through a DatagramProtocol and runs
+every session as tasks, so any number of peers costs tasks rather than
+threads. Blocking work goes to dedicated executors:
+    camera reads     one thread per video source
+    preprocess and   the loop's default executor (cv2 and NumPy release the
+    encode           GIL for most of the work)
+    terminal writes  the painter's writer thread
+    audio            PortAudio's own callback threads; packets are handed to
+                     the loop with call_soon_threadsafe
+Chat reads stdin through the loop as well. Cancelling a session (Ctrl-C or
+SIGTERM under `run`) unwinds every task and releases the camera, audio
+streams, painter and socket.
+
+Datagrams are routed by channel, and by sender host for channels a session
+attached to (`AsyncTransport.attach`), so several peer sessions can share
+one socket in the same process. The socket is read straight into a
+ReceiveRing, up to RECV_BATCH datagrams per wakeup, and payloads reach the
+sessions as memoryviews of it; audio decodes into the jitter buffer's
+recycled blocks.
+"""
+import asyncio
+import os
+import signal
+import socket
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from matrix_audio import (AUDIO_BUFFER_SIZE, SAMPLE_RATE, AudioSender, AudioSession, JitterBuffer,
+                          decode_audio, is_audio_packet)
+from matrix_chat import (BATCH_DELAY, ChatHistory, ReliableChat, format_history, history_path,
+                         run_command)
+from matrix_congestion import (REPORT_INTERVAL, RateController, ReceiverStats, group_settings,
+                               is_report, parse_report)
+from matrix_painter import TerminalPainter, effects_from_env
+from matrix_pipeline import FrameScheduler
+from matrix_preprocess import ASPECT_CORRECTION, Preprocessor
+from matrix_render import MATRIX_PALETTE, PALETTES, match_rows, style_from_env
+from matrix_sources import source_from_env
+from matrix_stats import Stats, overlay_enabled, stats_from_env, status_line
+from matrix_transport import (AUDIO, CHAT, CONTROL, FANOUT_DEPTH, MULTICAST_TTL, QUEUE_SIZES,
+                              TAG_MAGIC, VIDEO, ReceiveRing, is_multicast, tag)
+from matrix_wire import (PALETTE_NAMES, FrameDecoder, FrameEncoder, Reassembler, WireError,
+                         fragment, frame_stamp, is_fragment, is_keyframe_request, is_video_frame,
+                         keyframe_request)
+
+PORT = 5005
+VIDEO_WIDTH = 80  # Columns of the video grid
+VIDEO_FPS = 30  # Target frame rate; lowered automatically on slow machines
+VIDEO_BITS = 4  # Bits per cell in the video wire format
+KEYFRAME_REQUEST_INTERVAL = 0.25  # Minimum seconds between keyframe requests
+HISTORY_LINES = 20  # Chat scrollback shown when a chat starts
+
+# Per-stage timings shared by every session; published by stats_from_env
+stats = Stats()
+
+
+def _drop_oldest(target, item):
+    """Put on a bounded asyncio.Queue, discarding the oldest entry if full.
+    Return the number discarded."""
+    discarded = 0
+    while target.full():
+        target.get_nowait()
+        discarded += 1
+    target.put_nowait(item)
+    return discarded
+
+
+async def resolve(host, port=PORT):
+    """Return `host` as the IPv4 address recvfrom reports for it, so a peer
+    given by name matches the datagrams it sends."""
+    infos = await asyncio.get_running_loop().getaddrinfo(host, port, family=socket.AF_INET,
+                                                         type=socket.SOCK_DGRAM)
+    return infos[0][4][0]
+
+
+class AsyncTransport(asyncio.DatagramProtocol):
+    """The tagged-channel UDP transport as an asyncio protocol.
+
+    Create with `await AsyncTransport.create(port)`. `send` never blocks;
+    `recv` awaits the next (payload, address) on a channel, the payload
+    being a view into the receive ring (see ReceiveRing), or a copy if it
+    was still queued when the ring wrapped.
+
+    Where the loop can watch the socket (every selector loop), a reader
+    callback drains it with recvfrom_into; otherwise asyncio's datagram
+    transport delivers one bytes object per datagram.
+    """
+
+    def __init__(self):
+        self.transport = None
+        self.sock = None
+        self.ring = ReceiveRing(on_wrap=self._copy_queued)
+        self._loop = None  # Set when reading the socket through add_reader
+        self.unsent = 0  # Datagrams dropped because the socket buffer was full or the send failed
+        self.queues = {channel: asyncio.Queue(size) for channel, size in QUEUE_SIZES.items()}
+        self.attached = {}  # (host, channel) -> queue of a session bound to that host
+        self.dropped = dict.fromkeys(QUEUE_SIZES, 0)
+        self.ignored = 0  # Untagged or unknown-channel datagrams
+        self._tags = {channel: tag(channel) for channel in QUEUE_SIZES}
+
+    @classmethod
+    async def create(cls, port=PORT, bind_address=""):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((bind_address, port))
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, MULTICAST_TTL)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 0)
+        sock.setblocking(False)
+        loop = asyncio.get_running_loop()
+        protocol = cls()
+        protocol.sock = sock
+        try:
+            loop.add_reader(sock, protocol._readable)
+            protocol._loop = loop
+        except NotImplementedError:
+            await loop.create_datagram_endpoint(lambda: protocol, sock=sock)
+        return protocol
+
+    @property
+    def address(self):
+        return self.sock.getsockname()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def _readable(self):
+        try:
+            for data, address in self.ring.drain(self.sock):
+                self.datagram_received(data, address)
+        except OSError as exc:
+            self.error_received(exc)
+
+    def datagram_received(self, data, address):
+        if len(data) < 2 or data[0] != TAG_MAGIC or data[1] not in self.queues:
+            self.ignored += 1
+            return
+        channel = data[1]
+        target = self.attached.get((address[0], channel)) or self.queues[channel]
+        # Keep the newest data: discard the oldest queued payload
+        self.dropped[channel] += _drop_oldest(target, (data[2:], address))
+
+    def error_received(self, exc):
+        pass  # ICMP errors such as port unreachable; UDP carries on
+
+    def _copy_queued(self):
+        # The ring is about to write over its last lap: copy out every view still queued
+        for target in [*self.queues.values(), *self.attached.values()]:
+            for _ in range(target.qsize()):
+                data, address = target.get_nowait()
+                target.put_nowait((bytes(data) if isinstance(data, memoryview) else data, address))
+
+    def attach(self, host, channel):
+        """Route `channel` datagrams from `host` to a queue of their own."""
+        self.attached[(host, channel)] = asyncio.Queue(QUEUE_SIZES[channel])
+
+    def detach(self, host, channel):
+        self.attached.pop((host, channel), None)
+
+    def _queue(self, channel, host):
+        return self.attached.get((host, channel)) or self.queues[channel]
+
+    def join(self, group):
+        """Receive datagrams sent to a multicast group on this port."""
+        request = struct.pack("4s4s", socket.inet_aton(group), socket.inet_aton("0.0.0.0"))
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, request)
+
+    def send(self, channel, data, address):
+        """Send one payload on a channel; return False if it was not sent.
+
+        Like asyncio's datagram transport, this never raises: errors such
+        as an unreachable network go to `error_received`.
+        """
+        if self.transport is not None:
+            self.transport.sendto(self._tags[channel] + bytes(data), address)
+            return True
+        try:
+            self.sock.sendmsg([self._tags[channel], data], [], 0, address)
+            return True
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError as exc:
+            self.error_received(exc)
+        self.unsent += 1  # Like a loss on the wire; the receivers cope with those
+        return False
+
+    async def recv(self, channel, timeout=None, host=None):
+        """Return the next (payload, address); raises asyncio.TimeoutError."""
+        target = self._queue(channel, host)
+        if not target.empty():
+            return target.get_nowait()  # Already queued: skip the timeout machinery
+        if timeout is None:
+            return await target.get()
+        return await asyncio.wait_for(target.get(), timeout)
+
+    def recv_nowait(self, channel, host=None):
+        """Return the next (payload, address) on a channel, or None."""
+        try:
+            return self._queue(channel, host).get_nowait()
+        except asyncio.QueueEmpty:
+            return None
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+        elif self.sock.fileno() != -1:
+            self._loop.remove_reader(self.sock)
+            self.sock.close()
+
+
+class AsyncFanOut:
+    """Send the same packets to several addresses through per-peer queues.
+
+    `send` never blocks: one task per peer drains its own queue, and a peer
+    that falls FANOUT_DEPTH payloads behind loses its oldest ones, so a slow
+    or unreachable peer only loses its own backlog. A multicast group
+    address counts as a single recipient.
+    """
+
+    def __init__(self, transport, addresses, depth=FANOUT_DEPTH):
+        self.transport = transport
+        self.queues = {address: asyncio.Queue(depth) for address in addresses}
+        self.dropped = dict.fromkeys(self.queues, 0)
+        self.errors = dict.fromkeys(self.queues, 0)
+        self._tasks = [asyncio.ensure_future(self._run(address)) for address in self.queues]
+
+    def send(self, channel, packets):
+        item = (channel, packets)
+        for address, peer_queue in self.queues.items():
+            self.dropped[address] += _drop_oldest(peer_queue, item)
+
+    async def _run(self, address):
+        peer_queue = self.queues[address]
+        while True:
+            channel, packets = await peer_queue.get()
+            for packet in packets:
+                if not self.transport.send(channel, packet, address):
+                    self.errors[address] += 1
+                    break  # Skip the rest of this payload
+            await asyncio.sleep(0)  # Let other peers' queues drain in turn
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+class LatestValue:
+    """Async single-slot hand-off where `put` replaces an untaken item."""
+
+    def __init__(self):
+        self._item = None
+        self._ready = asyncio.Event()
+        self.dropped = 0
+
+    def put(self, item):
+        if self._ready.is_set():
+            self.dropped += 1
+        self._item = item
+        self._ready.set()
+
+    async def get(self):
+        await self._ready.wait()
+        self._ready.clear()
+        item, self._item = self._item, None
+        return item
+
+
+def poll_control(transport, encoder, controllers):
+    """Drain the control channel, honouring keyframe requests and feeding
+    receiver reports to a rate controller per receiver. Return True if the
+    settings may have changed."""
+    changed = False
+    for address, controller in list(controllers.items()):
+        if controller.stale():
+            del controllers[address]  # Receiver went away; stop encoding for it
+            changed = True
+        else:
+            changed = controller.tick() or changed
+    while True:
+        item = transport.recv_nowait(CONTROL)
+        if item is None:
+            return changed
+        data, address = item
+        if is_keyframe_request(data):
+            encoder.request_keyframe()
+        elif is_report(data):
+            if address not in controllers:
+                controllers[address] = RateController(VIDEO_WIDTH, VIDEO_BITS, VIDEO_FPS)
+            changed = controllers[address].on_report(data) or changed
+
+
+async def send_video(transport, peers, palette=None, source=None, port=PORT):
+    """Capture, preprocess, encode and send to every peer.
+
+    `palette` (default: MATRIX_STYLE, else matrix) is offered to receivers;
+    half-block palettes get a grid with twice the rows.
+
+    Capture and processing are separate tasks joined by a latest-value slot,
+    so a slow encode never makes the camera queue stale frames. `peers` may
+    mix IPs and multicast groups; each frame is encoded once for all.
+    """
+    loop = asyncio.get_running_loop()
+    camera = ThreadPoolExecutor(1, thread_name_prefix="camera")
+    cap = source or await loop.run_in_executor(camera, source_from_env)
+    fanout = AsyncFanOut(transport, [(peer, port) for peer in peers])
+    palette = palette or style_from_env()
+    encoder = FrameEncoder(palette, VIDEO_BITS)
+    preprocess = Preprocessor(VIDEO_WIDTH, aspect=ASPECT_CORRECTION / PALETTES[palette].rows_per_cell)
+    scheduler = FrameScheduler(VIDEO_FPS, width=VIDEO_WIDTH)
+    controllers = {}  # Receiver address -> RateController
+    frames = LatestValue()
+
+    def read():
+        with stats.stage("capture"):
+            return cap.read()
+
+    def convert(frame):
+        # Preprocess and encode together on an executor thread; only the
+        # newest frame gets here, and it is always encoded, so a skipped
+        # frame is never a keyframe that later deltas refer to
+        with stats.stage("preprocess"):
+            pixels = preprocess(frame)
+        with stats.stage("encode"):
+            return encoder.encode(pixels)
+
+    async def capture():
+        while True:
+            if cap.realtime:
+                await asyncio.sleep(max(0.0, scheduler.next_delay()))
+            ret, frame = await loop.run_in_executor(camera, read)
+            if not ret:
+                frames.put(None)
+                return
+            frames.put(frame)
+
+    async def process():
+        while True:
+            frame = await frames.get()
+            if frame is None:
+                return
+            if poll_control(transport, encoder, controllers):
+                # Back off (or recover) to what the weakest receiver can take
+                width, bits, fps = group_settings(controllers.values(), VIDEO_WIDTH, VIDEO_BITS,
+                                                  VIDEO_FPS)
+                scheduler.limit(fps, width)
+                encoder.set_bits(bits)
+                stats.gauges.update(width=width, bits=bits, fps=fps)
+            scheduler.begin()
+            preprocess.width = scheduler.width
+            seq, data = await loop.run_in_executor(None, convert, frame)
+            scheduler.done()
+            started = time.perf_counter()
+            fanout.send(VIDEO, list(fragment(data, seq)))
+            stats.stage("send").record(time.perf_counter() - started, len(data))
+            stats.gauges["scheduler_dropped"] = scheduler.dropped
+
+    capturing = asyncio.ensure_future(capture())
+    try:
+        await process()
+    finally:
+        capturing.cancel()
+        await asyncio.gather(capturing, return_exceptions=True)
+        await fanout.close()
+        await loop.run_in_executor(camera, cap.release)  # After any read in flight
+        camera.shutdown(wait=False)
+
+
+async def receive_video(transport, palette=None, source=None, renderer=None):
+    """Render incoming frames with `palette` or the sender's choice.
+
+    With `source` set, only frames from that host are taken (through their
+    own queue, so other sessions can share the transport). A TiledRenderer
+    passed as `renderer` is closed with the painter; create it before any
+    thread starts, as its workers are forked.
+    """
+    forced = PALETTES[palette] if palette else None
+    painter = TerminalPainter(forced or MATRIX_PALETTE, stats=stats, renderer=renderer,
+                              **effects_from_env()).start()
+    if source is not None:
+        source = await resolve(source)
+        transport.attach(source, VIDEO)
+    reassembler = Reassembler()
+    decoder = FrameDecoder()
+    link = ReceiverStats()
+    overlay = overlay_enabled()
+    shown = None  # Stats snapshot behind the overlay text
+    sender = None
+    last_request = 0.0
+    try:
+        while True:
+            if sender is not None:
+                # Tell the sender how the link is doing so it can adapt its rate
+                report = link.report(reassembler.dropped)
+                if report is not None:
+                    transport.send(CONTROL, report, sender)
+                    loss, jitter, _fps, _failures = parse_report(report)
+                    stats.gauges.update(loss=loss, jitter_ms=jitter, painter_dropped=painter.dropped,
+                                        reassembly_dropped=reassembler.dropped)
+            try:
+                data, sender = await transport.recv(VIDEO, REPORT_INTERVAL, source)
+            except asyncio.TimeoutError:
+                continue
+            received = time.monotonic()
+            try:
+                if is_fragment(data):
+                    with stats.stage("reassemble"):
+                        data = reassembler.add(data)
+                    if data is None:
+                        continue  # Frame still incomplete
+                elif not is_video_frame(data):
+                    continue
+                stats.stage("receive").record(time.monotonic() - received, len(data))
+                link.on_frame(*frame_stamp(data))
+                with stats.stage("decode"):
+                    frame = decoder.decode(data)
+            except WireError:
+                continue
+            if frame is None:
+                # Late frame, or a delta whose keyframe was lost; ask for a new one
+                stats.count("undecodable")
+                if decoder.needs_keyframe and received - last_request >= KEYFRAME_REQUEST_INTERVAL:
+                    transport.send(CONTROL, keyframe_request(), sender)
+                    last_request = received
+                continue
+            sent = PALETTES.get(PALETTE_NAMES.get(frame.palette), MATRIX_PALETTE)
+            if palette is None:
+                painter.set_palette(sent)
+            # A palette chosen here may draw a different number of rows per cell
+            pixels = match_rows(frame.pixels, sent.rows_per_cell, (forced or sent).rows_per_cell)
+            if overlay and stats.latest is not shown:
+                shown = stats.latest
+                painter.status = status_line(shown)
+            painter.submit(pixels, received)
+    finally:
+        if source is not None:
+            transport.detach(source, VIDEO)
+        await asyncio.get_running_loop().run_in_executor(None, painter.close)
+
+
+async def send_audio(transport, peer, session, port=PORT):
+    """Stream the microphone; offers the preferred formats in-band."""
+    import sounddevice as sd  # Only audio sessions need PortAudio
+
+    loop = asyncio.get_running_loop()
+    address = (peer, port)
+    sender = AudioSender(session)
+
+    def callback(indata, frames, time_info, status):
+        # Runs on PortAudio's thread: encode here, send from the loop
+        if session.offer_due():
+            loop.call_soon_threadsafe(transport.send, AUDIO, session.offer(), address)
+        with stats.stage("audio_send"):
+            packet = sender.encode(indata[:, 0])
+        loop.call_soon_threadsafe(transport.send, AUDIO, packet, address)
+
+    stream = sd.InputStream(samplerate=SAMPLE_RATE, channels=1, dtype="float32", callback=callback,
+                            blocksize=AUDIO_BUFFER_SIZE)
+    stream.start()
+    try:
+        await asyncio.Event().wait()  # Until cancelled
+    finally:
+        stream.stop()
+        stream.close()
+
+
+async def receive_audio(transport, session, source=None):
+    """Play incoming audio through a jitter buffer; also answers format offers."""
+    import sounddevice as sd
+
+    jitter = JitterBuffer(SAMPLE_RATE, AUDIO_BUFFER_SIZE)
+
+    def callback(outdata, frames, time_info, status):
+        with stats.stage("audio_write"):
+            jitter.read(frames, outdata[:, 0])
+
+    if source is not None:
+        source = await resolve(source)
+        transport.attach(source, AUDIO)
+    stream = sd.OutputStream(samplerate=SAMPLE_RATE, channels=1, dtype="float32", callback=callback,
+                             blocksize=AUDIO_BUFFER_SIZE)
+    stream.start()
+    try:
+        while True:
+            audio_data, sender = await transport.recv(AUDIO, host=source)
+            if not is_audio_packet(audio_data):
+                reply = session.handle(audio_data)
+                if reply:
+                    transport.send(AUDIO, reply, sender)
+                continue
+            try:
+                jitter.push(decode_audio(audio_data, jitter.buffer))
+            except WireError:
+                continue
+    finally:
+        if source is not None:
+            transport.detach(source, AUDIO)
+        stream.stop()
+        stream.close()
+
+
+async def stdin_lines():
+    """Yield lines typed on stdin without blocking the loop."""
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    pipe = None
+    try:
+        # Read a duplicate so closing the pipe transport leaves fd 0 open
+        stdin = open(os.dup(sys.stdin.fileno()), "rb", buffering=0)
+        pipe, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), stdin)
+    except (NotImplementedError, OSError, ValueError):
+        # No pipe support (e.g. Windows consoles): read on a daemon thread,
+        # which cannot hold up interpreter exit the way an executor would
+        def pump():
+            for line in sys.stdin:
+                loop.call_soon_threadsafe(reader.feed_data, line.encode())
+            loop.call_soon_threadsafe(reader.feed_eof)
+        threading.Thread(target=pump, daemon=True).start()
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            yield line.decode(errors="replace").rstrip("\r\n")
+    finally:
+        if pipe is not None:
+            pipe.close()
+            os.set_blocking(sys.stdin.fileno(), True)  # The duplicate shared the non-blocking flag
+
+
+async def chat(transport, peer, port=PORT, history=None):
+    """Interactive reliable chat with one peer until "exit" or end of input."""
+    peer = await resolve(peer, port)
+    own_history = history is None
+    history = history or ChatHistory(history_path())
+    wake = asyncio.Event()
+    session = ReliableChat(transport, (peer, port), CHAT, history,
+                           on_message=lambda message, address: print("\nPeer:", message),
+                           on_failed=lambda message: print("\n(not delivered)", message))
+    transport.attach(peer, CHAT)
+
+    async def sender():
+        while True:
+            wake.clear()
+            due = session.next_send()
+            if due is None or due > time.monotonic():
+                timeout = None if due is None else due - time.monotonic()
+                try:
+                    await asyncio.wait_for(wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await asyncio.sleep(BATCH_DELAY)  # Let a burst of lines join the batch
+            for datagram in session.service():
+                transport.send(CHAT, datagram, session.address)
+
+    async def receiver():
+        while True:
+            try:
+                data, address = await transport.recv(CHAT, 1.0, peer)
+            except asyncio.TimeoutError:
+                session.poll()  # Release messages held behind one the peer gave up on
+                continue
+            session.handle(data, address)
+
+    print("\n".join(format_history(history.recent(peer, HISTORY_LINES), peer)))
+    tasks = [asyncio.ensure_future(sender()), asyncio.ensure_future(receiver())]
+    try:
+        print("You: ", end="", flush=True)
+        async for message in stdin_lines():
+            if message.lower() == "exit":
+                print("Exiting chat...")
+                break
+            # /history [n] and /search <text> look through past messages
+            if not run_command(message, history, peer):
+                session.send(message)
+                wake.set()
+            print("You: ", end="", flush=True)
+        # Give queued messages a moment to be acknowledged
+        deadline = time.monotonic() + 1.0
+        while session.unacked and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        transport.detach(peer, CHAT)
+        if own_history:
+            history.close()
+
+
+async def supervise(**coroutines):
+    """Run named coroutines together. One failing (say, no audio device) is
+    reported and the rest keep going; cancelling cancels them all."""
+    async def guarded(name, coroutine):
+        try:
+            await coroutine
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            print(f"\n{name} stopped: {exc!r}", file=sys.stderr)
+
+    await asyncio.gather(*(guarded(name, coroutine) for name, coroutine in coroutines.items()))
+
+
+async def video_session(peer, palette=None, port=PORT, transport=None, renderer=None):
+    """Two-way video and audio with one peer."""
+    own = transport is None
+    transport = transport or await AsyncTransport.create(port)
+    audio = AudioSession()
+    try:
+        await supervise(
+            video_send=send_video(transport, [peer], port=port),
+            video_receive=receive_video(transport, palette, renderer=renderer),
+            audio_send=send_audio(transport, peer, audio, port),
+            audio_receive=receive_audio(transport, audio),
+        )
+    finally:
+        if own:
+            transport.close()
+
+
+async def group_session(peers, port=PORT, transport=None):
+    """Send one encoded video stream to several peers and multicast groups."""
+    own = transport is None
+    transport = transport or await AsyncTransport.create(port)
+    try:
+        await send_video(transport, peers, port=port)
+    finally:
+        if own:
+            transport.close()
+
+
+async def watch_session(source, palette=None, port=PORT, transport=None, renderer=None):
+    """Receive only: from one host, or from anyone on a multicast group."""
+    own = transport is None
+    transport = transport or await AsyncTransport.create(port)
+    try:
+        if is_multicast(source):
+            transport.join(source)
+            await receive_video(transport, palette, renderer=renderer)
+        else:
+            await receive_video(transport, palette, source=source, renderer=renderer)
+    finally:
+        if own:
+            transport.close()
+
+
+async def chat_session(peer, port=PORT, transport=None):
+    own = transport is None
+    transport = transport or await AsyncTransport.create(port)
+    try:
+        await chat(transport, peer, port)
+    finally:
+        if own:
+            transport.close()
+
+
+def run(coroutine):
+    """Run a session until it finishes, Ctrl-C or SIGTERM, shutting down cleanly."""
+    async def main():
+        task = asyncio.ensure_future(coroutine)
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGTERM, task.cancel)
+        except (NotImplementedError, RuntimeError):
+            pass  # No signal handlers on this platform or thread
+        reporter = stats_from_env(stats)
+        try:
+            await task
+        except asyncio.CancelledError:
+            task.cancel()  # Ctrl-C cancelled us; take the session down with us
+            await asyncio.gather(task, return_exceptions=True)
+        finally:
+            if reporter is not None:
+                reporter.stop()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass  # asyncio.run already cancelled and awaited the session
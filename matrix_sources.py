@@ -0,0 +1,268 @@
+"""Frame sources: camera, video file, synthetic generator and recordings.
+
+Every source has the cv2.VideoCapture calls the scripts already use
+(`isOpened()`, `read() -> (ret, frame)`, `release()`), so any of them can
+stand in for the camera. Frames are BGR from the camera and video files and
+grayscale from the synthetic generator and recordings; Preprocessor takes
+either.
+
+A recording is one file of fixed-size grayscale frames after a small
+header, plus a `.idx` file of float64 timestamps (seconds from the first
+frame). Replay maps the frames with np.memmap and hands out views, so
+nothing is copied until the frame is preprocessed.
+
+`source_from_env()` picks a source from the environment, so the scripts
+can run headless:
+    MATRIX_SOURCE  camera index (default 0), "synthetic", a video file or a
+                   recording (*.mxrec)
+    MATRIX_RECORD  also record every frame read to this .mxrec path
+    MATRIX_SPEED   "max" to replay files and recordings as fast as possible
+"""
+import abc
+import os
+import struct
+import time
+
+import cv2
+import numpy as np
+
+RECORDING_MAGIC = b"MXRC"
+RECORDING_VERSION = 1
+RECORDING_HEADER = struct.Struct("!4sBxHH6x")  # magic, version, width, height; padded to 16 bytes
+RECORDING_SUFFIX = ".mxrec"
+INDEX_SUFFIX = ".idx"
+
+SYNTHETIC_SIZE = (640, 480)
+SYNTHETIC_FPS = 30
+NOISE_LEVEL = 6  # Amplitude of the synthetic sensor noise
+
+
+class FrameSource(abc.ABC):
+    """Base class: pacing and the VideoCapture-style calls."""
+
+    def __init__(self, realtime=True):
+        self.realtime = realtime  # False: return frames as fast as they are read
+        self.frames = 0
+        self._start = None
+
+    def _pace(self, offset):
+        """Sleep until `offset` seconds after the first frame."""
+        now = time.monotonic()
+        if self._start is None:
+            self._start = now - offset
+        elif self.realtime:
+            delay = self._start + offset - now
+            if delay > 0:
+                time.sleep(delay)
+
+    def isOpened(self):
+        return True
+
+    @abc.abstractmethod
+    def read(self):
+        """Return (ok, frame) like VideoCapture.read."""
+
+    def release(self):
+        pass
+
+
+class CameraSource(FrameSource):
+    """A live camera; it paces itself."""
+
+    def __init__(self, index=0):
+        super().__init__()
+        self.cap = cv2.VideoCapture(index)
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Don't let the driver queue stale frames
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def read(self):
+        ret, frame = self.cap.read()
+        self.frames += ret
+        return ret, frame
+
+    def release(self):
+        self.cap.release()
+
+
+class FileSource(FrameSource):
+    """A video file, paced at its own frame rate unless `realtime` is off."""
+
+    def __init__(self, path, realtime=True, loop=False):
+        super().__init__(realtime)
+        self.path = path
+        self.loop = loop
+        self.cap = cv2.VideoCapture(path)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or SYNTHETIC_FPS
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def read(self):
+        ret, frame = self.cap.read()
+        if not ret and self.loop and self.frames:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.cap.read()
+        if ret:
+            self._pace(self.frames / self.fps)
+            self.frames += 1
+        return ret, frame
+
+    def release(self):
+        self.cap.release()
+
+
+class SyntheticSource(FrameSource):
+    """Deterministic grayscale test frames: a drifting gradient, a moving
+    disc and bar, and seeded noise. `count` limits the number of frames."""
+
+    def __init__(self, size=SYNTHETIC_SIZE, fps=SYNTHETIC_FPS, seed=0, count=None, realtime=True):
+        super().__init__(realtime)
+        self.width, self.height = size
+        self.fps = fps
+        self.count = count
+        self.rng = np.random.default_rng(seed)
+        self._gradient = np.add.outer(np.arange(self.height) * 128 // self.height,
+                                      np.arange(self.width) * 128 // self.width).astype(np.int16)
+
+    def frame(self, index):
+        """Return frame `index` (noise depends on the call order)."""
+        t = index / self.fps
+        image = (self._gradient + index * 2) % 256
+        cx = int(self.width * (0.5 + 0.35 * np.sin(t * 1.3)))
+        cy = int(self.height * (0.5 + 0.3 * np.cos(t * 0.9)))
+        radius = min(self.width, self.height) // 6
+        cv2.circle(image, (cx, cy), radius, 235, -1)
+        bar = int((t * self.width / 4) % self.width)
+        image[:, bar:bar + self.width // 20] = 20
+        image += self.rng.integers(-NOISE_LEVEL, NOISE_LEVEL + 1, image.shape, dtype=np.int16)
+        return np.clip(image, 0, 255).astype(np.uint8)
+
+    def read(self):
+        if self.count is not None and self.frames >= self.count:
+            return False, None
+        self._pace(self.frames / self.fps)
+        frame = self.frame(self.frames)
+        self.frames += 1
+        return True, frame
+
+
+class Recorder:
+    """Append grayscale frames and their timestamps to a recording."""
+
+    def __init__(self, path):
+        self.path = path
+        self.shape = None
+        self.count = 0
+        self._file = None
+        self._index = None
+        self._start = None
+
+    def write(self, frame, timestamp=None):
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if self._file is None:
+            self.shape = frame.shape
+            self._start = timestamp
+            self._file = open(self.path, "wb")
+            self._index = open(self.path + INDEX_SUFFIX, "wb")
+            self._file.write(RECORDING_HEADER.pack(RECORDING_MAGIC, RECORDING_VERSION,
+                                                   self.shape[1], self.shape[0]))
+        elif frame.shape != self.shape:
+            raise ValueError(f"frame shape {frame.shape} does not match recording {self.shape}")
+        self._file.write(np.ascontiguousarray(frame, dtype=np.uint8).data)
+        self._index.write(struct.pack("=d", timestamp - self._start))
+        self.count += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._index.close()
+
+
+class ReplaySource(FrameSource):
+    """Play back a recording with its original timing, or as fast as possible."""
+
+    def __init__(self, path, realtime=True, loop=False):
+        super().__init__(realtime)
+        with open(path, "rb") as file:
+            header = file.read(RECORDING_HEADER.size)
+        if len(header) < RECORDING_HEADER.size:
+            raise ValueError(f"{path} is not a recording")
+        magic, version, width, height = RECORDING_HEADER.unpack(header)
+        if magic != RECORDING_MAGIC or version != RECORDING_VERSION:
+            raise ValueError(f"{path} is not a version {RECORDING_VERSION} recording")
+        count = (os.path.getsize(path) - RECORDING_HEADER.size) // (width * height)
+        self.timestamps = np.fromfile(path + INDEX_SUFFIX, dtype=np.float64)[:count]
+        self.frames_map = np.memmap(path, dtype=np.uint8, mode="r", offset=RECORDING_HEADER.size,
+                                    shape=(len(self.timestamps), height, width))
+        self.loop = loop
+        self._position = 0
+        self._lap = 0.0  # Time offset added on each loop
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def read(self):
+        if self._position >= len(self.timestamps):
+            if not self.loop or not len(self.timestamps):
+                return False, None
+            self._lap += self.timestamps[-1] + 1 / SYNTHETIC_FPS
+            self._position = 0
+        self._pace(self._lap + self.timestamps[self._position])
+        frame = self.frames_map[self._position]
+        self._position += 1
+        self.frames += 1
+        return True, frame
+
+    def release(self):
+        self.frames_map = None
+
+
+class RecordingSource(FrameSource):
+    """Pass frames through from another source while recording them."""
+
+    def __init__(self, source, path):
+        super().__init__(source.realtime)
+        self.source = source
+        self.recorder = Recorder(path)
+
+    def isOpened(self):
+        return self.source.isOpened()
+
+    def read(self):
+        ret, frame = self.source.read()
+        if ret:
+            self.recorder.write(frame)
+            self.frames += 1
+        return ret, frame
+
+    def release(self):
+        self.source.release()
+        self.recorder.close()
+
+
+def open_source(spec=None, realtime=True, record=None):
+    """Open a source from a spec: a camera index, "synthetic", a recording
+    (*.mxrec) or a video file path. None means camera 0."""
+    spec = "0" if spec is None else str(spec)
+    if spec.isdigit():
+        source = CameraSource(int(spec))
+    elif spec == "synthetic":
+        source = SyntheticSource(realtime=realtime)
+    elif spec.endswith(RECORDING_SUFFIX):
+        source = ReplaySource(spec, realtime=realtime)
+    else:
+        source = FileSource(spec, realtime=realtime)
+    if record:
+        source = RecordingSource(source, record)
+    return source
+
+
+def source_from_env(environ=os.environ):
+    """Open the source named by MATRIX_SOURCE, MATRIX_RECORD and MATRIX_SPEED."""
+    return open_source(environ.get("MATRIX_SOURCE"),
+                       realtime=environ.get("MATRIX_SPEED", "").lower() != "max",
+                       record=environ.get("MATRIX_RECORD"))
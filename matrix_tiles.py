@@ -0,0 +1,134 @@
+"""Multi-process frame rendering in row bands over shared memory.
+
+Each terminal row renders independently (coalescing restarts after every
+line end), so a frame splits into horizontal bands that worker processes
+render in parallel. The parent turns the frame into cell codes (which may
+look at neighbouring rows, e.g. for edge glyphs) and copies them into a
+shared-memory block; each worker renders its rows from there straight into
+its slot of a shared output block, and the parent joins the slots into the
+frame bytes. Only the band bounds and the returned lengths cross the
+process boundary; the codes and the rendered bytes never get pickled.
+
+Workers are forked so the video scripts' top-level code is not re-run in
+them. Create the renderer before starting any thread: a fork copies only
+the calling thread, and a lock another thread holds stays held in every
+worker. Where fork is unavailable, or for grids under TILE_MIN_CELLS where a
+round trip to the pool costs more than it saves, rendering stays in-process.
+`renderer_from_env()` reads MATRIX_RENDER_WORKERS: a worker count, or
+"auto" for one per core.
+"""
+import multiprocessing
+import os
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from matrix_render import MATRIX_PALETTE, PALETTES
+
+TILE_MIN_CELLS = 200 * 50  # Smaller grids render faster in-process
+BANDS_PER_WORKER = 2  # Smaller bands even out uneven rows
+
+_segments = {}  # Worker side: shared-memory blocks attached so far, by name
+
+
+def _attach(*names):
+    # The parent replaces its blocks when frames grow; let go of the old ones
+    for name in [name for name in _segments if name not in names]:
+        _segments.pop(name).close()
+    for name in names:
+        if name not in _segments:
+            _segments[name] = shared_memory.SharedMemory(name)
+    return [_segments[name] for name in names]
+
+
+def _render_band(task):
+    """Render rows [first, last) of the shared code grid into the output block."""
+    codes_name, output_name, shape, dtype, first, last, palette, coalesce, offset = task
+    if isinstance(palette, str):
+        palette = PALETTES[palette]
+    codes_block, output_block = _attach(codes_name, output_name)
+    codes = np.ndarray(shape, dtype=dtype, buffer=codes_block.buf)[first:last]
+    data = palette.render_codes(codes, coalesce)
+    output_block.buf[offset:offset + len(data)] = data
+    return len(data)
+
+
+def row_bytes(palette, width):
+    """Return the most bytes a rendered row of `width` cells can take."""
+    return width * palette.cell_width + int(palette.lengths[palette.line_end_slot])
+
+
+class TiledRenderer:
+    """Render frames with a palette across a pool of worker processes.
+
+    `render(pixels, palette)` returns the same bytes as
+    `palette.render(pixels, coalesce=True)`, and `render_codes(codes,
+    palette)` those of `palette.render_codes(codes, coalesce=True)`.
+    """
+
+    def __init__(self, workers=None, min_cells=TILE_MIN_CELLS):
+        self.workers = workers or os.cpu_count() or 1
+        self.min_cells = min_cells
+        self.pool = None
+        self.codes = None  # Shared code grid and output blocks, grown as needed
+        self.output = None
+        if self.workers > 1 and "fork" in multiprocessing.get_all_start_methods():
+            # Workers must share our resource tracker; one of their own would
+            # unlink the blocks when the worker exits
+            resource_tracker.ensure_running()
+            self.pool = multiprocessing.get_context("fork").Pool(self.workers)
+
+    def _blocks(self, nbytes, rows, row_size):
+        if self.codes is None or self.codes.size < nbytes:
+            self._release()
+            self.codes = shared_memory.SharedMemory(create=True, size=nbytes)
+        if self.output is None or self.output.size < rows * row_size:
+            if self.output is not None:
+                self.output.close()
+                self.output.unlink()
+            self.output = shared_memory.SharedMemory(create=True, size=rows * row_size)
+        return self.codes, self.output
+
+    def render(self, pixels, palette=MATRIX_PALETTE, coalesce=True):
+        return self.render_codes(palette.cell_codes(pixels), palette, coalesce)
+
+    def render_codes(self, codes, palette=MATRIX_PALETTE, coalesce=True):
+        if self.pool is None or codes.size < self.min_cells:
+            return palette.render_codes(codes, coalesce)
+        rows, width = codes.shape
+        size = row_bytes(palette, width)
+        source, output = self._blocks(codes.nbytes, rows, size)
+        np.ndarray(codes.shape, dtype=codes.dtype, buffer=source.buf)[:] = codes
+
+        # Registered palettes travel by name; others are pickled with each band
+        name = next((key for key, value in PALETTES.items() if value is palette), palette)
+        bands = min(rows, self.workers * BANDS_PER_WORKER)
+        bounds = np.linspace(0, rows, bands + 1).astype(int).tolist()
+        tasks = [(source.name, output.name, codes.shape, codes.dtype.str, first, last, name, coalesce,
+                  first * size)
+                 for first, last in zip(bounds, bounds[1:]) if last > first]
+        lengths = self.pool.map(_render_band, tasks)
+        view = output.buf
+        return b"".join(view[task[-1]:task[-1] + length] for task, length in zip(tasks, lengths))
+
+    def _release(self):
+        for block in (self.codes, self.output):
+            if block is not None:
+                block.close()
+                block.unlink()
+        self.codes = self.output = None
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        self._release()
+
+
+def renderer_from_env(environ=os.environ):
+    """Return a TiledRenderer if MATRIX_RENDER_WORKERS asks for one, else None."""
+    setting = environ.get("MATRIX_RENDER_WORKERS", "")
+    if setting in ("", "0", "1"):
+        return None
+    return TiledRenderer(None if setting == "auto" else int(setting))
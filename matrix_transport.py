@@ -0,0 +1,83 @@
+"""Wire constants and receive buffer for the single-socket transport.
+
+One UDP socket is bound to the session port and carries video, audio, chat
+and control. Every datagram starts with a two-byte tag (TAG_MAGIC, channel
+id); matrix_runtime.AsyncTransport reads the socket on the event loop and
+dispatches each payload to its channel's bounded queue (QUEUE_SIZES),
+dropping the oldest entry when a consumer falls behind.
+
+Datagrams are received with recvfrom_into into a ReceiveRing, one
+preallocated arena, and queued as memoryviews of it, so the receive path
+allocates nothing per packet but the address tuple.
+"""
+import ipaddress
+
+PORT = 5005
+MAX_DATAGRAM = 65536
+
+TAG_MAGIC = 0x4D  # "M"
+VIDEO = 1
+AUDIO = 2
+CHAT = 3
+CONTROL = 4
+CHANNEL_NAMES = {VIDEO: "video", AUDIO: "audio", CHAT: "chat", CONTROL: "control"}
+
+# Queue depth per channel; video holds fragments, audio only a few blocks
+QUEUE_SIZES = {VIDEO: 256, AUDIO: 16, CHAT: 256, CONTROL: 64}
+
+RING_SIZE = 4 * 1024 * 1024  # Receive arena; payloads still queued when it wraps are copied out
+RECV_BATCH = 64  # Datagrams drained per wakeup where the socket is non-blocking
+MULTICAST_TTL = 1  # Keep multicast on the local network
+FANOUT_DEPTH = 4  # Payloads queued per peer before the oldest is dropped
+
+
+def tag(channel):
+    """Return the two-byte prefix for a channel."""
+    return bytes((TAG_MAGIC, channel))
+
+
+def is_multicast(host):
+    try:
+        return ipaddress.ip_address(host).is_multicast
+    except ValueError:
+        return False
+
+
+class ReceiveRing:
+    """Receive datagrams back to back into one preallocated buffer.
+
+    `recv` returns a memoryview of the payload it just wrote. The ring wraps
+    to the start when fewer than MAX_DATAGRAM bytes remain, and then writes
+    over the views it handed out a lap earlier: consumers decode or copy a
+    payload when they take it, and `on_wrap()` is called just before each
+    wrap so the owner can copy the views it still holds.
+    """
+
+    def __init__(self, size=RING_SIZE, on_wrap=None):
+        self.buffer = bytearray(max(size, 2 * MAX_DATAGRAM))
+        self.view = memoryview(self.buffer)
+        self.offset = 0
+        self.wraps = 0
+        self.on_wrap = on_wrap
+
+    def recv(self, sock):
+        """Receive one datagram; return (payload view, address)."""
+        offset = self.offset
+        if len(self.buffer) - offset < MAX_DATAGRAM:
+            if self.on_wrap is not None:
+                self.on_wrap()
+            offset = 0
+            self.wraps += 1
+        nbytes, address = sock.recvfrom_into(self.view[offset:offset + MAX_DATAGRAM])
+        self.offset = offset + nbytes
+        return self.view[offset:offset + nbytes], address
+
+    def drain(self, sock, limit=RECV_BATCH):
+        """Yield up to `limit` datagrams from a non-blocking socket, stopping
+        when it has nothing more to read."""
+        for _ in range(limit):
+            try:
+                yield self.recv(sock)
+            except (BlockingIOError, InterruptedError):
+                return
+
@@ -0,0 +1,464 @@
+"""Compact binary wire format for the video feed.
+
+Instead of rendered ANSI text, each datagram carries a small header and a
+quantized, bit-packed luminance grid. The receiver renders the grid with
+whatever palette it likes.
+
+Header (network byte order):
+    magic     3s  b"MXV"
+    version   B
+    flags     B   FLAG_DELTA, FLAG_ZLIB or FLAG_LZMA
+    seq       I   frame sequence number, wraps at 2**32
+    timestamp I   sender clock in milliseconds, wraps at 2**32
+    width     H   grid columns
+    height    H   grid rows
+    palette   B   sender's palette id (see PALETTE_IDS)
+    bits      B   bits per cell, 1-8
+
+Frames are either keyframes or deltas. A delta starts with the sequence
+number of its keyframe and carries the XOR of its levels against it, so a
+lost delta costs only itself; a receiver that misses a keyframe asks for a
+new one with a KEYFRAME_REQUEST datagram. Payloads may be compressed with
+zlib or lzma, whichever is smallest within a measured CPU budget.
+
+Encoded frames are split into MTU-sized fragments so wide feeds never rely
+on IP-level fragmentation. Each fragment has its own header:
+    magic     3s  b"MXF"
+    version   B
+    frame     I   frame id (the frame's sequence number)
+    index     H   fragment index
+    count     H   fragments in the frame
+"""
+import lzma
+import struct
+import time
+import zlib
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+MAGIC = b"MXV"
+VERSION = 2
+HEADER = struct.Struct("!3sBBIIHHBB")
+DEFAULT_BITS = 4
+
+FLAG_DELTA = 0x01  # Payload is XORed against the keyframe named in DELTA_REF
+FLAG_ZLIB = 0x02
+FLAG_LZMA = 0x04
+DELTA_REF = struct.Struct("!I")
+KEYFRAME_INTERVAL = 60  # Frames between scheduled keyframes
+KEYFRAME_CHANGE = 0.5  # Changed-cell fraction that forces a keyframe
+DEAD_ZONE = 0.25  # Fraction of a bin a pixel may stray before its cell changes
+COMPRESSION_CHOICES = [("zlib", 1), ("zlib", 6), ("zlib", 9), ("lzma", 0), ("lzma", 6)]
+COMPRESSION_BUDGET = 0.002  # Seconds of compress time allowed per frame
+KEYFRAME_REQUEST = b"MXK"
+
+FRAGMENT_MAGIC = b"MXF"
+FRAGMENT_HEADER = struct.Struct("!3sBIHH")
+MAX_DATAGRAM = 1200  # Fits the path MTU of VPNs and IPv6 tunnels
+MAX_FRAGMENTS = 1024  # Largest frame accepted by a Reassembler
+REASSEMBLY_TIMEOUT = 0.5  # Seconds before an incomplete frame is dropped
+REASSEMBLY_FRAMES = 8  # Incomplete frames held at once
+RESYNC_GAP = 64  # Frames a sequence number may fall back before it counts as a sender restart
+
+PALETTE_IDS = {"matrix": 0, "blocks": 1, "ascii": 2, "half-256": 3, "half-truecolor": 4,
+               "half-matrix": 5, "matrix-truecolor": 6}
+PALETTE_NAMES = {number: name for name, number in PALETTE_IDS.items()}
+
+Frame = namedtuple("Frame", "seq timestamp palette bits pixels")
+
+
+class WireError(ValueError):
+    """Raised when a datagram is not a well-formed frame or packet."""
+
+
+def timestamp_ms():
+    """Return the wall clock in milliseconds, wrapped to 32 bits."""
+    return int(time.time() * 1000) & 0xFFFFFFFF
+
+
+def seq_newer(seq, last):
+    """Return True if `seq` comes after `last`, allowing for wraparound."""
+    return 0 < (seq - last) & 0xFFFFFFFF < 0x80000000
+
+
+def seq_restarted(seq, last):
+    """Return True if `seq` is so far behind `last`, or back at the 0 every
+    FrameEncoder starts from, that the sender must have restarted."""
+    behind = (last - seq) & 0xFFFFFFFF
+    return 0 < behind < 0x80000000 and (behind >= RESYNC_GAP or seq == 0)
+
+
+def quantize(pixels, bits=DEFAULT_BITS):
+    """Reduce 8-bit intensities to `bits`-bit levels."""
+    return np.asarray(pixels, dtype=np.uint8) >> (8 - bits)
+
+
+def dequantize(levels, bits=DEFAULT_BITS):
+    """Expand levels back to 8-bit intensities at the center of each bin."""
+    if bits == 8:
+        return levels.astype(np.uint8)
+    return ((levels.astype(np.uint8) << (8 - bits)) | (1 << (7 - bits))).astype(np.uint8)
+
+
+def pack_levels(levels, bits=DEFAULT_BITS):
+    """Bit-pack a grid of levels, most significant bit first."""
+    flat = levels.astype(np.uint8).reshape(-1, 1)
+    return np.packbits(np.unpackbits(flat, axis=1)[:, 8 - bits:]).tobytes()
+
+
+def unpack_levels(data, count, bits=DEFAULT_BITS):
+    """Inverse of `pack_levels`: return `count` levels as a flat uint8 array."""
+    planes = np.unpackbits(np.frombuffer(data, dtype=np.uint8), count=count * bits)
+    planes = planes.reshape(count, bits)
+    weights = (1 << np.arange(bits - 1, -1, -1)).astype(np.uint8)
+    return planes @ weights if bits > 1 else planes[:, 0]
+
+
+def compress(payload, codec, level):
+    """Compress a payload with "zlib" or "lzma"; return (flag, data)."""
+    if codec == "zlib":
+        return FLAG_ZLIB, zlib.compress(payload, level)
+    if codec == "lzma":
+        return FLAG_LZMA, lzma.compress(payload, format=lzma.FORMAT_ALONE, preset=level)
+    raise ValueError(f"unknown compression {codec!r}")
+
+
+def decompress(payload, flags):
+    """Undo `compress` according to the frame flags."""
+    try:
+        if flags & FLAG_ZLIB:
+            return zlib.decompress(payload)
+        if flags & FLAG_LZMA:
+            return lzma.decompress(payload, format=lzma.FORMAT_ALONE)
+    except (zlib.error, lzma.LZMAError) as exc:
+        raise WireError(f"corrupt compressed payload: {exc}") from None
+    return bytes(payload)
+
+
+def pick_compression(sample, budget=COMPRESSION_BUDGET, repeat=3):
+    """Return the (codec, level) giving the smallest output for `sample`
+    whose measured compress time stays within `budget` seconds."""
+    best, best_size = ("zlib", 1), None
+    for codec, level in COMPRESSION_CHOICES:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            _, data = compress(sample, codec, level)
+        cost = (time.perf_counter() - started) / repeat
+        if cost <= budget and (best_size is None or len(data) < best_size):
+            best, best_size = (codec, level), len(data)
+    return best
+
+
+def encode_levels(levels, seq, palette="matrix", bits=DEFAULT_BITS, timestamp=None,
+                  reference=None, compression=None):
+    """Encode a grid of quantized levels as one video frame.
+
+    With `reference=(key_seq, key_levels)` the frame is a delta holding the
+    XOR of the levels against that keyframe, which is zero wherever a cell
+    is unchanged. `compression` is a (codec, level) pair or None.
+    """
+    if not 1 <= bits <= 8:
+        raise ValueError(f"bits must be between 1 and 8, not {bits}")
+    height, width = levels.shape
+    flags = 0
+    prefix = b""
+    if reference is not None:
+        key_seq, key_levels = reference
+        levels = levels ^ key_levels
+        flags |= FLAG_DELTA
+        prefix = DELTA_REF.pack(key_seq & 0xFFFFFFFF)
+    payload = pack_levels(levels, bits)
+    if compression is not None:
+        flag, packed = compress(payload, *compression)
+        if len(packed) < len(payload):
+            flags |= flag
+            payload = packed
+    header = HEADER.pack(
+        MAGIC, VERSION, flags, seq & 0xFFFFFFFF,
+        timestamp_ms() if timestamp is None else timestamp,
+        width, height, PALETTE_IDS.get(palette, palette), bits,
+    )
+    return header + prefix + payload
+
+
+def encode_frame(pixels, seq, palette="matrix", bits=DEFAULT_BITS, timestamp=None, compression=None):
+    """Encode a grayscale grid as one self-contained (key) video frame."""
+    return encode_levels(quantize(pixels, bits), seq, palette, bits, timestamp,
+                         compression=compression)
+
+
+def is_video_frame(data):
+    """Cheap check for the video magic, used to route datagrams."""
+    return data[:len(MAGIC)] == MAGIC
+
+
+def frame_stamp(data):
+    """Return (seq, timestamp_ms) from a video frame without decoding it."""
+    if len(data) < HEADER.size or data[:len(MAGIC)] != MAGIC:
+        raise WireError("not a video frame")
+    _magic, _version, _flags, seq, timestamp, *_rest = HEADER.unpack_from(data)
+    return seq, timestamp
+
+
+def read_frame(data):
+    """Parse a video frame into (header, ref_seq, levels).
+
+    `ref_seq` is None for keyframes; for deltas `levels` still holds the XOR
+    against that keyframe.
+    """
+    if len(data) < HEADER.size:
+        raise WireError("datagram shorter than the frame header")
+    magic, version, flags, seq, timestamp, width, height, palette, bits = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise WireError("not a video frame")
+    if version != VERSION:
+        raise WireError(f"unsupported frame version {version}")
+    if not 1 <= bits <= 8:
+        raise WireError(f"invalid bit depth {bits}")
+    offset = HEADER.size
+    ref_seq = None
+    if flags & FLAG_DELTA:
+        if len(data) < offset + DELTA_REF.size:
+            raise WireError("delta frame without a reference")
+        (ref_seq,) = DELTA_REF.unpack_from(data, offset)
+        offset += DELTA_REF.size
+    count = width * height
+    payload = decompress(memoryview(data)[offset:], flags)
+    if len(payload) * 8 < count * bits:
+        raise WireError("truncated frame payload")
+    levels = unpack_levels(payload, count, bits).reshape(height, width)
+    header = Frame(seq, timestamp, palette, bits, None)
+    return header, ref_seq, levels
+
+
+def decode_frame(data):
+    """Decode a keyframe into a Frame with 8-bit `pixels`."""
+    header, ref_seq, levels = read_frame(data)
+    if ref_seq is not None:
+        raise WireError("delta frame needs a FrameDecoder")
+    return header._replace(pixels=dequantize(levels, header.bits))
+
+
+def fragment(data, frame_id, max_datagram=MAX_DATAGRAM):
+    """Split an encoded frame into datagrams of at most `max_datagram` bytes."""
+    chunk = max_datagram - FRAGMENT_HEADER.size
+    count = max(1, -(-len(data) // chunk))
+    if count > MAX_FRAGMENTS:
+        raise ValueError(f"frame needs {count} fragments, more than {MAX_FRAGMENTS}")
+    view = memoryview(data)
+    frame_id &= 0xFFFFFFFF
+    return [
+        FRAGMENT_HEADER.pack(FRAGMENT_MAGIC, VERSION, frame_id, index, count)
+        + view[index * chunk:(index + 1) * chunk]
+        for index in range(count)
+    ]
+
+
+def is_fragment(data):
+    """Cheap check for the fragment magic, used to route datagrams."""
+    return data[:len(FRAGMENT_MAGIC)] == FRAGMENT_MAGIC
+
+
+class Reassembler:
+    """Rebuild frames from fragments in a bounded buffer.
+
+    Incomplete frames are dropped when they time out, when the buffer is
+    full, or as soon as a newer frame completes, so a lost fragment never
+    stalls the feed. Fragments are copied once, straight to their place in
+    the frame; a frame that fits one datagram comes back as a view of it.
+    """
+
+    def __init__(self, max_frames=REASSEMBLY_FRAMES, timeout=REASSEMBLY_TIMEOUT):
+        self.max_frames = max_frames
+        self.timeout = timeout
+        # frame id -> [started, frame buffer, fragments missing, fragments seen, chunk, last fragment]
+        self.pending = OrderedDict()
+        self.last_completed = None
+        self.completed = 0
+        self.dropped = 0  # Incomplete frames given up on
+        self.late = 0  # Fragments for frames already superseded
+
+    def add(self, data, now=None):
+        """Add one fragment; return the whole frame once it is complete."""
+        if len(data) < FRAGMENT_HEADER.size:
+            raise WireError("datagram shorter than the fragment header")
+        magic, version, frame_id, index, count = FRAGMENT_HEADER.unpack_from(data)
+        if magic != FRAGMENT_MAGIC:
+            raise WireError("not a frame fragment")
+        if version != VERSION:
+            raise WireError(f"unsupported fragment version {version}")
+        if not 0 <= index < count <= MAX_FRAGMENTS:
+            raise WireError(f"invalid fragment {index} of {count}")
+        now = time.monotonic() if now is None else now
+        self.expire(now)
+
+        if self.last_completed is not None and not seq_newer(frame_id, self.last_completed):
+            if not seq_restarted(frame_id, self.last_completed):
+                self.late += 1
+                return None
+            # The sender restarted: forget the old session's frames
+            self.dropped += len(self.pending)
+            self.pending.clear()
+            self.last_completed = None
+        payload = memoryview(data)[FRAGMENT_HEADER.size:]
+        if count == 1:
+            frame = payload
+        else:
+            frame = self._add_part(frame_id, index, count, payload, now)
+            if frame is None:
+                return None
+
+        self.pending.pop(frame_id, None)
+        self.last_completed = frame_id
+        self.completed += 1
+        # Anything older than the frame just finished is no longer worth waiting for
+        for stale in [fid for fid in self.pending if not seq_newer(fid, frame_id)]:
+            del self.pending[stale]
+            self.dropped += 1
+        return frame
+
+    def _add_part(self, frame_id, index, count, payload, now):
+        entry = self.pending.get(frame_id)
+        if entry is None:
+            if len(self.pending) >= self.max_frames:
+                self.pending.popitem(last=False)
+                self.dropped += 1
+            entry = self.pending[frame_id] = [now, None, count, bytearray(count), 0, None]
+        _started, buffer, missing, seen, chunk, last = entry
+        if len(seen) != count:
+            raise WireError("fragment count changed within a frame")
+        if seen[index]:
+            return None
+        if index == count - 1:
+            last = entry[5] = bytes(payload)  # Placed once the fragment size is known
+        else:
+            if buffer is None:
+                chunk = entry[4] = len(payload)
+                buffer = entry[1] = bytearray(count * chunk)
+            elif len(payload) != chunk:
+                raise WireError("fragment size changed within a frame")
+            buffer[index * chunk:(index + 1) * chunk] = payload
+        seen[index] = 1
+        missing = entry[2] = missing - 1
+        if missing:
+            return None
+        if len(last) > chunk:
+            raise WireError("last fragment longer than the others")
+        end = (count - 1) * chunk + len(last)
+        buffer[(count - 1) * chunk:end] = last
+        return memoryview(buffer)[:end]
+
+    def expire(self, now):
+        """Drop incomplete frames older than the timeout."""
+        while self.pending:
+            frame_id, entry = next(iter(self.pending.items()))
+            if now - entry[0] < self.timeout:
+                break
+            del self.pending[frame_id]
+            self.dropped += 1
+
+
+class FrameEncoder:
+    """Encode a stream of grids as periodic keyframes plus deltas."""
+
+    def __init__(self, palette="matrix", bits=DEFAULT_BITS, keyframe_interval=KEYFRAME_INTERVAL,
+                 compression=None, budget=COMPRESSION_BUDGET, dead_zone=DEAD_ZONE):
+        self.palette = palette
+        self.bits = bits
+        self.keyframe_interval = keyframe_interval
+        # Sensor noise near a bin edge would otherwise flip cells every frame
+        self.dead_zone = dead_zone
+        self.margin = int((1 << (8 - bits)) * dead_zone)
+        self.compression = compression  # Picked from the first delta when None
+        self.budget = budget
+        self.seq = 0
+        self.key_seq = None
+        self.key_levels = None
+        self.since_keyframe = 0
+        self.keyframe_wanted = True
+
+    def request_keyframe(self):
+        """Make the next frame a keyframe, e.g. after a receiver lost one."""
+        self.keyframe_wanted = True
+
+    def set_bits(self, bits):
+        """Change the bit depth; the next frame is a keyframe at the new depth."""
+        if bits != self.bits:
+            self.bits = bits
+            self.margin = int((1 << (8 - bits)) * self.dead_zone)
+            self.key_levels = None
+
+    def encode(self, pixels, timestamp=None):
+        """Encode the next frame and return (seq, data)."""
+        pixels = np.asarray(pixels, dtype=np.uint8)
+        levels = quantize(pixels, self.bits)
+        if self.margin and self.key_levels is not None and self.key_levels.shape == levels.shape:
+            low = self.key_levels.astype(np.int16) << (8 - self.bits)
+            high = low + (1 << (8 - self.bits))
+            steady = (pixels >= low - self.margin) & (pixels < high + self.margin)
+            levels = np.where(steady, self.key_levels, levels)
+        seq = self.seq
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        keyframe = (
+            self.keyframe_wanted
+            or self.key_levels is None
+            or self.key_levels.shape != levels.shape
+            or self.since_keyframe >= self.keyframe_interval
+            or np.count_nonzero(levels != self.key_levels) > KEYFRAME_CHANGE * levels.size
+        )
+        if keyframe:
+            self.key_seq, self.key_levels = seq, levels
+            self.keyframe_wanted = False
+            self.since_keyframe = 0
+            reference = None
+        else:
+            self.since_keyframe += 1
+            reference = (self.key_seq, self.key_levels)
+            if self.compression is None:
+                self.compression = pick_compression(pack_levels(levels ^ self.key_levels, self.bits),
+                                                    self.budget)
+        data = encode_levels(levels, seq, self.palette, self.bits, timestamp, reference,
+                             self.compression or ("zlib", 1))
+        return seq, data
+
+
+class FrameDecoder:
+    """Decode keyframes and deltas, tracking the keyframe deltas refer to."""
+
+    def __init__(self):
+        self.key_seq = None
+        self.key_levels = None
+        self.last_seq = None
+        self.late = 0
+        self.needs_keyframe = False  # Set when a delta arrived without its keyframe
+
+    def decode(self, data):
+        """Return a Frame, or None if it is late or its keyframe is missing."""
+        header, ref_seq, levels = read_frame(data)
+        if self.last_seq is not None and not seq_newer(header.seq, self.last_seq):
+            if not seq_restarted(header.seq, self.last_seq):
+                self.late += 1
+                return None
+            # The sender restarted: its deltas refer to its own keyframes
+            self.last_seq = self.key_seq = self.key_levels = None
+        if ref_seq is None:
+            self.key_seq, self.key_levels = header.seq, levels
+            self.needs_keyframe = False
+        elif ref_seq != self.key_seq or self.key_levels.shape != levels.shape:
+            self.needs_keyframe = True
+            return None
+        else:
+            levels = levels ^ self.key_levels
+        self.last_seq = header.seq
+        return header._replace(pixels=dequantize(levels, header.bits))
+
+
+def keyframe_request():
+    """Return the datagram a receiver sends to ask for a keyframe."""
+    return KEYFRAME_REQUEST + bytes([VERSION])
+
+
+def is_keyframe_request(data):
+    """Check whether a datagram is a keyframe request."""
+    return data[:len(KEYFRAME_REQUEST)] == KEYFRAME_REQUEST